@@ -6,10 +6,18 @@ from flask_login import LoginManager, login_required, login_user, logout_user
 from flask_migrate import Migrate
 from flask_bootstrap import Bootstrap
 from datetime import timedelta
+import os
+import tempfile
 from flask_mail import Mail
 
 # local imports
 from config import app_config
+from .audit import AuditLogWriter
+from .database import PoolMonitor
+from .offload import BackgroundTasks
+from .profiling import RequestProfiler
+from .templating import FragmentCache
+from .throttle import LoginGuard
 
 # create db instance
 db = SQLAlchemy()
@@ -20,6 +28,24 @@ mail = Mail()
 # create a LoginManager instance
 login_manager = LoginManager()
 
+# create the buffered audit log writer
+audit_log = AuditLogWriter()
+
+# create the connection pool monitor
+db_pool = PoolMonitor()
+
+# create the request profiler, enabled by PROFILE_REQUESTS
+profiler = RequestProfiler()
+
+# create the login rate limiter and password check pool
+login_guard = LoginGuard()
+
+# create the thread pool for blocking I/O done on behalf of a request
+background = BackgroundTasks()
+
+# create the template fragment cache, it also installs the shared bytecode cache
+fragments = FragmentCache()
+
 
 def create_app(config_name):
     app = Flask(__name__, instance_relative_config=True)
@@ -29,6 +55,28 @@ def create_app(config_name):
     app.config['PERMANENT_SESSION_LIFETIME'] =  timedelta(hours=1)
     # configurate the maximum allowed payload of upload file
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # number of sheet rows bulk loaded per COPY when a monthly report is uploaded
+    app.config.setdefault('UPLOAD_CHUNK_ROWS', 5000)
+    # background import worker processes and how often idle workers poll the queue (seconds)
+    app.config.setdefault('IMPORT_WORKERS', 2)
+    app.config.setdefault('IMPORT_POLL_INTERVAL', 2)
+    # (anchor, month) payrolls whose salaries are computed again per transaction
+    app.config.setdefault('SALARY_RECALC_BATCH', 500)
+    # rows per page of the anchor, payroll and comment listings
+    app.config.setdefault('PAGE_SIZE', 50)
+    # largest page the JSON API returns, whatever limit is asked for
+    app.config.setdefault('API_MAX_PAGE_SIZE', 500)
+    # largest payroll export sent as a workbook, bigger ones are streamed as CSV
+    app.config.setdefault('EXPORT_XLSX_MAX_ROWS', 50000)
+    # version tokens shared by every process to invalidate their local caches
+    app.config.setdefault('CACHE_VERSION_DIR', os.path.join(tempfile.gettempdir(), 'flask_app_versions'))
+    # salary history charts kept in memory by each process
+    app.config.setdefault('CHART_CACHE_SIZE', 500)
+    # logged in employees kept in memory by each process, and for how long (seconds)
+    app.config.setdefault('IDENTITY_CACHE_SIZE', 1000)
+    app.config.setdefault('IDENTITY_CACHE_TTL', 300)
+    # werkzeug method of new password hashes, with the iteration count; older hashes are upgraded on login
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
 
     # add email smtp
     """
@@ -39,15 +87,23 @@ def create_app(config_name):
     app.config['MAIL_USERNAME'] = "mengn9603@gmail.com"
     app.config['MAIL_PASSWORD'] = 'secret_password'
     """
-    app.config['MAIL_SERVER'] = 'smtpdm.aliyun.com'
-    app.config['MAIL_PORT'] = 465
-    app.config['MAIL_USE_SSL'] = True
-    app.config['MAIL_USERNAME'] = "noreply@mail.xuanpin.ltd"
-    app.config['MAIL_PASSWORD'] = 'PIvotal2019'
+    # the environment may point to another server, e.g. a local one in load tests
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtpdm.aliyun.com')
+    app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 465))
+    app.config['MAIL_USE_SSL'] = os.getenv('MAIL_USE_SSL', 'true').lower() in ('1', 'true', 'yes')
+    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME', "noreply@mail.xuanpin.ltd")
+    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD', 'PIvotal2019')
     
     # initialize Plugins
     mail.init_app(app)
+    # sets the engine options, so it goes before the engine is configured
+    db_pool.init_app(app)
     db.init_app(app)
+    audit_log.init_app(app)
+    profiler.init_app(app)
+    login_guard.init_app(app)
+    background.init_app(app)
+    fragments.init_app(app)
     Bootstrap(app)
     login_manager.init_app(app)
 
@@ -82,6 +138,9 @@ def create_app(config_name):
         from .home import home as home_blueprint
         app.register_blueprint(home_blueprint)
 
+        from .api import api as api_blueprint
+        app.register_blueprint(api_blueprint, url_prefix='/api')
+
     # configure error handling
     @app.errorhandler(403)
     def forbidden(error):
@@ -0,0 +1,36 @@
+# -*- coding: UTF-8 -*-
+from collections import namedtuple
+
+from ..cache import VersionedCache, bump_version
+from ..models import Anchor
+
+AnchorEntry = namedtuple('AnchorEntry', ['id', 'name', 'percentage', 'ace_anchor_or_not'])
+
+_index = VersionedCache('anchors')
+
+
+def _load():
+    rows = Anchor.query.with_entities(Anchor.momo_number, Anchor.id, Anchor.name,
+                                      Anchor.percentage, Anchor.ace_anchor_or_not).all()
+    return {r[0]: AnchorEntry(*r[1:]) for r in rows}
+
+
+def anchor_index():
+    """
+    Return a dict of every anchor keyed by momo_number, rebuilt only after anchors changed
+    """
+    return _index.get('all', _load)
+
+
+def find_anchor(momo_number):
+    """
+    Return the AnchorEntry of a momo_number, None if there is no such anchor
+    """
+    return anchor_index().get(momo_number)
+
+
+def invalidate_anchor_index():
+    """
+    To be called after an anchor is added, edited or deleted
+    """
+    bump_version('anchors')
@@ -0,0 +1,116 @@
+# -*- coding: UTF-8 -*-
+import csv
+import io
+import math
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from ..models import Anchor
+from .summary import refresh_summaries
+
+# one line of a pasted table or uploaded file, error is None if it can be inserted
+BulkRow = namedtuple('BulkRow', ['line', 'momo_number', 'value', 'error'])
+
+# a first line with one of these in the momo number column is a header
+HEADERS = {'momo_number', 'momo', u'陌陌号'}
+
+# rows per insert statement, well below the bind parameter limit of postgres
+INSERT_CHUNK = 5000
+
+
+def read_upload(storage):
+    """
+    Return the text of an uploaded CSV file, saved as UTF-8 or as the GBK of a Chinese Excel
+    """
+    raw = storage.read()
+    try:
+        return raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return raw.decode('gbk', errors='replace')
+
+
+def parse_amount(raw):
+    try:
+        amount = float(raw)
+    except ValueError:
+        raise ValueError(u'数额无效')
+    if amount == 0 or not math.isfinite(amount):
+        raise ValueError(u'数额无效')
+    return amount
+
+
+def parse_comment(raw):
+    if not raw:
+        raise ValueError(u'备注为空')
+    return raw
+
+
+def parse_rows(content, parse_value):
+    """
+    Split a table of momo numbers and values into BulkRows. Lines are tab separated
+    when pasted from a spreadsheet, comma separated otherwise; the value is
+    everything after the momo number.
+    """
+    delimiter = '\t' if '\t' in content else ','
+    reader = csv.reader(io.StringIO(content), delimiter=delimiter)
+    rows = []
+    for fields in reader:
+        fields = [f.strip() for f in fields]
+        if not any(fields):
+            continue
+        momo_number, raw = fields[0], delimiter.join(fields[1:]).strip()
+        if not rows and momo_number.lower() in HEADERS:
+            continue
+        if not momo_number:
+            rows.append(BulkRow(reader.line_num, momo_number, raw, u'缺少陌陌号'))
+            continue
+        try:
+            rows.append(BulkRow(reader.line_num, momo_number, parse_value(raw), None))
+        except ValueError as e:
+            rows.append(BulkRow(reader.line_num, momo_number, raw, str(e)))
+    return rows
+
+
+def insert_rows(connection, table, column, rows, date):
+    """
+    Check the momo numbers of rows against the anchors in one query, insert the
+    valid rows dated date with multi-row inserts and refresh the summaries of
+    their anchors. Return the rows with the errors found and the new ids.
+    """
+    numbers = {r.momo_number for r in rows if r.error is None}
+    known = set()
+    if numbers:
+        known = {n for n, in connection.execute(
+            select([Anchor.momo_number]).where(Anchor.momo_number.in_(numbers)))}
+
+    checked = [r if r.error is not None or r.momo_number in known else r._replace(error=u'陌陌号不存在')
+               for r in rows]
+    valid = [r for r in checked if r.error is None]
+
+    ids = []
+    for i in range(0, len(valid), INSERT_CHUNK):
+        values = [{'anchor_momo': r.momo_number, 'date': date, column: r.value}
+                  for r in valid[i:i + INSERT_CHUNK]]
+        ids.extend(n for n, in connection.execute(table.insert().values(values).returning(table.c.id)))
+    if valid:
+        refresh_summaries(connection, date, sorted({r.momo_number for r in valid}))
+    return checked, ids
+
+
+def submitted_rows(form, parse_value):
+    """
+    Return the BulkRows of the uploaded file of a bulk entry form, or of its pasted table
+    """
+    if form.upload_file.data:
+        return parse_rows(read_upload(form.upload_file.data), parse_value)
+    return parse_rows(form.rows.data or '', parse_value)
+
+
+def id_range(ids):
+    """
+    Target of the audit entry of a bulk insert, short enough for the log's target_id
+    """
+    if not ids:
+        return None
+    return '{}-{}'.format(min(ids), max(ids)) if len(ids) > 1 else ids[0]
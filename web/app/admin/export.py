@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+import csv
+import io
+import os
+import tempfile
+
+from openpyxl import Workbook
+from sqlalchemy import func, select
+
+from .. import db
+from ..database import disable_statement_timeout
+from ..models import Anchor, Payroll
+
+# header of the exported sheet and the columns it is read from
+EXPORT_COLUMNS = [
+    ('月份', Payroll.date),
+    ('陌陌号', Payroll.anchor_momo),
+    ('播主姓名', Anchor.name),
+    ('提成', Anchor.percentage),
+    ('金牌主播', Anchor.ace_anchor_or_not),
+    ('总陌币', Payroll.coins),
+    ('公会分成金额', Payroll.guild_division),
+    ('播主奖励', Payroll.anchor_reward),
+    ('实际收入', Payroll.profit),
+    ('罚款', Payroll.penalty),
+    ('工资', Payroll.salary),
+]
+
+
+def export_query(start=None, end=None, momo_number=None):
+    """
+    Select the payrolls of the months in [start, end) and/or of one anchor, in month and momo number order
+    """
+    query = select([column for _, column in EXPORT_COLUMNS]) \
+        .select_from(Payroll.__table__.join(Anchor.__table__, Anchor.momo_number == Payroll.anchor_momo)) \
+        .order_by(Payroll.date, Payroll.anchor_momo)
+    if start is not None:
+        query = query.where(Payroll.date >= start)
+    if end is not None:
+        query = query.where(Payroll.date < end)
+    if momo_number is not None:
+        query = query.where(Payroll.anchor_momo == momo_number)
+    return query
+
+
+def export_count(query):
+    """
+    Count the rows an export query selects
+    """
+    return db.session.execute(select([func.count()]).select_from(query.order_by(None).alias())).scalar()
+
+
+def iter_rows(query, batch_size=1000):
+    """
+    Yield the rows of a query from a server-side cursor, batch_size rows at a time
+    """
+    connection = db.engine.connect()
+    try:
+        # a large export is streamed for longer than DB_STATEMENT_TIMEOUT allows
+        connection.begin()
+        disable_statement_timeout(connection)
+        result = connection.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                # a payroll entered without a date must not cut the stream short
+                yield [row[0].strftime('%Y-%m') if row[0] else ''] + list(row[1:])
+    finally:
+        connection.close()
+
+
+def iter_csv(rows, batch_size=1000):
+    """
+    Encode rows as CSV chunks, with a BOM so that Excel opens the Chinese header as UTF-8
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    # the header goes out before the first batch is fetched
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+
+    for n, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if n % batch_size == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def iter_xlsx(rows, chunk_size=64 * 1024):
+    """
+    Write rows to a write-only workbook on disk and stream the file.
+    A workbook is a zip archive that can only be sent once it is complete, the rows
+    go through a temporary file so memory use does not grow with the export.
+    Nothing is sent while it is written, keep it to EXPORT_XLSX_MAX_ROWS rows.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('payrolls')
+    sheet.append([name for name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        sheet.append(row)
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
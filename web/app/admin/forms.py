@@ -161,3 +161,19 @@ class CommentForm(FlaskForm):
     submit = SubmitField(u'提交')
 
 
+class BulkPenaltyForm(FlaskForm):
+    """
+    Form to input many penalties at once, pasted from a spreadsheet or as a CSV file
+    """
+    rows = TextAreaField(u'陌陌号 数额 (每行一条)', render_kw={'rows': 12})
+    upload_file = FileField(u'或上传CSV文件')
+    submit = SubmitField(u'提交')
+
+
+class BulkCommentForm(FlaskForm):
+    """
+    Form to input many comments at once, pasted from a spreadsheet or as a CSV file
+    """
+    rows = TextAreaField(u'陌陌号 备注 (每行一条)', render_kw={'rows': 12})
+    upload_file = FileField(u'或上传CSV文件')
+    submit = SubmitField(u'提交')
@@ -1,11 +1,19 @@
 import psutil
+import pandas as pd
+from bokeh.embed import components
 from bokeh.models import HoverTool, FactorRange
 from bokeh.plotting import figure
 from bokeh.models.sources import ColumnDataSource
+from flask import current_app
+from sqlalchemy import func
 import datetime
 
-from ..models import Log
-from .. import db
+from .. import audit_log, db
+from ..cache import VersionedCache
+from ..models import PayrollAnchorSummary
+
+# rendered (script, div) of the salary history charts, keyed by anchor and data stamp
+_charts = None
 
  
 def get_system_info():
@@ -21,7 +29,7 @@ def create_line_chart(df, title, width=800, height=300):
     Create a line and circle chart with name of x axis, y axis and hover tool.
     """
     # convert date object to string and factorize the month as x_axis lable
-    df.date = df.date.apply(lambda x: datetime.datetime.strftime(x, '%Y-%m'))
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m')
     xdr = FactorRange(factors=df.date)
 
     source = ColumnDataSource(df)
@@ -46,17 +54,42 @@ def create_line_chart(df, title, width=800, height=300):
     return plot
 
 
+def salary_history_chart(momo_number, name):
+    """
+    Return the bokeh (script, div) of an anchor's salary history.
+
+    The chart is built from the anchor's summary rows and cached per process. The key
+    holds the latest refresh time and row count of those rows, so a chart is rebuilt
+    as soon as a payroll, penalty or comment of that anchor changes the summaries,
+    and the charts of the other anchors are kept.
+    """
+    global _charts
+    if _charts is None:
+        # not the 'payrolls' data set, every import would drop the charts of all anchors;
+        # the stamp in the key is what invalidates a chart, a bump only empties the cache
+        _charts = VersionedCache('salary_charts', maxsize=current_app.config['CHART_CACHE_SIZE'])
+
+    stamp = db.session.query(func.max(PayrollAnchorSummary.updated), func.count()) \
+        .filter(PayrollAnchorSummary.anchor_momo == momo_number).one()
+
+    def build():
+        history = db.session.query(PayrollAnchorSummary.month, PayrollAnchorSummary.salary) \
+            .filter(PayrollAnchorSummary.anchor_momo == momo_number) \
+            .order_by(PayrollAnchorSummary.month).all()
+        df = pd.DataFrame(history, columns=['date', 'salary'])
+        return components(create_line_chart(df, name + "工资历史纪录"))
+
+    return _charts.get((momo_number, name, tuple(stamp)), build)
+
+
 def add_log(user, action, target_id=None, target_table=None, status='S'):
-    log = Log(date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), 
-              action = action, 
-              target_id = target_id,
-              target_table = target_table,
-              user = user, 
-              status = status)
-    try:
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        error = str(e.__dict__['orig'])
-        print(error)
+    """
+    Queue an audit log record, it is written to the logs table in bulk by the audit log writer
+    """
+    # values are cut to the column sizes so one long value cannot fail a whole batch
+    audit_log.record(dict(date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                          action = action[:20],
+                          target_id = str(target_id)[:20] if target_id is not None else None,
+                          target_table = target_table[:120] if target_table else target_table,
+                          user = user[:20],
+                          status = status))
@@ -0,0 +1,231 @@
+# -*- coding: UTF-8 -*-
+import contextlib
+import csv
+import datetime
+import io
+import re
+import zipfile
+
+import xlrd
+from xlrd.compdoc import CompDocError
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+# columns kept from the monthly sheet, in staging table order
+STAGING_COLUMNS = [
+    (u'月份', 'text'),
+    (u'陌陌号', 'text'),
+    (u'播主姓名', 'text'),
+    (u'结算方式', 'text'),
+    (u'总陌币', 'double precision'),
+    (u'公会分成金额', 'double precision'),
+    (u'播主奖励', 'double precision'),
+    (u'实际收入', 'double precision'),
+]
+REQUIRED_COLUMNS = [u'月份', u'陌陌号', u'总陌币', u'公会分成金额', u'播主奖励', u'实际收入']
+
+# first bytes of a legacy .xls workbook (an OLE2 compound document); uploads are
+# stored as .xlsx whatever they were, so the format is told from the content
+XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# raised by xlrd and openpyxl for a file that is not a workbook, or a damaged one
+UNREADABLE_WORKBOOK = (zipfile.BadZipFile, InvalidFileException, KeyError,
+                       xlrd.XLRDError, CompDocError)
+
+
+class IngestError(Exception):
+    """
+    Raised when an uploaded sheet cannot be staged
+    """
+    pass
+
+
+class SheetStats(object):
+    """
+    What is learned about a sheet while it is being streamed into the staging table
+    """
+    def __init__(self):
+        self.month = None
+        self.row_count = 0
+        self.momo_numbers = set()
+
+
+def _clean_header(value):
+    # "公会分成金额(元)" -> "公会分成金额"
+    return re.sub(u'\\(元\\)', '', str(value)).strip() if value is not None else None
+
+
+def _clean_momo(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() if value is not None else None
+
+
+def _clean_month(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime('%Y-%m')
+    return str(value).strip() if value is not None else None
+
+
+def is_xls(path):
+    with open(path, 'rb') as f:
+        return f.read(len(XLS_SIGNATURE)) == XLS_SIGNATURE
+
+
+def _xls_values(sheet, datemode):
+    for r in range(sheet.nrows):
+        values = []
+        for cell in sheet.row(r):
+            if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                values.append(None)
+            elif cell.ctype == xlrd.XL_CELL_DATE:
+                values.append(xlrd.xldate.xldate_as_datetime(cell.value, datemode))
+            else:
+                values.append(cell.value)
+        yield tuple(values)
+
+
+@contextlib.contextmanager
+def open_sheet(path):
+    """
+    Open the first sheet of a workbook, yields (rows, max_row): an iterator of
+    row value tuples and the number of rows recorded in the file, None if unknown.
+    An .xlsx is streamed read-only, a legacy .xls (at most 65536 rows) is read
+    whole by xlrd as pandas did before. A file that cannot be opened as a workbook
+    raises IngestError.
+    """
+    if is_xls(path):
+        try:
+            book = xlrd.open_workbook(path, on_demand=True)
+        except UNREADABLE_WORKBOOK as e:
+            raise IngestError(u'上传文件不是有效的Excel文件: {}'.format(e))
+        try:
+            sheet = book.sheet_by_index(0)
+            yield _xls_values(sheet, book.datemode), sheet.nrows
+        finally:
+            book.release_resources()
+    else:
+        try:
+            workbook = load_workbook(path, read_only=True, data_only=True)
+        except UNREADABLE_WORKBOOK as e:
+            raise IngestError(u'上传文件不是有效的Excel文件: {}'.format(e))
+        try:
+            sheet = workbook.worksheets[0]
+            yield sheet.iter_rows(values_only=True), sheet.max_row
+        finally:
+            workbook.close()
+
+
+def iter_sheet_rows(path):
+    """
+    Stream the rows of the first sheet as tuples ordered like STAGING_COLUMNS.
+    An .xlsx is opened read-only so only the current row is held in memory.
+    Rows settled as "对私" are skipped, as they were before.
+    """
+    with open_sheet(path) as (rows, _):
+        header = [_clean_header(h) for h in next(rows, [])]
+
+        missing = [c for c in REQUIRED_COLUMNS if c not in header]
+        if missing:
+            raise IngestError(u'上传文件缺少以下列: ' + u', '.join(missing))
+
+        positions = [header.index(c) if c in header else None for c, _ in STAGING_COLUMNS]
+        for row in rows:
+            if not any(v is not None for v in row):
+                continue
+            values = [row[i] if i is not None and i < len(row) else None for i in positions]
+            if values[3] == u'对私':
+                continue
+            values[0] = _clean_month(values[0])
+            values[1] = _clean_momo(values[1])
+            yield values
+
+
+def create_staging_table(connection, tablename):
+    """
+    Create a temporary staging table, it is not WAL-logged and is dropped when the
+    import transaction ends so no raw sheet is left behind in the database
+    """
+    columns = ', '.join('{} {}'.format(name, kind) for name, kind in STAGING_COLUMNS)
+    connection.execute('create temporary table {} ({}) on commit drop'.format(tablename, columns))
+
+
+def copy_rows(connection, tablename, rows):
+    """
+    Bulk load a chunk of rows with COPY ... FROM STDIN
+    """
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+
+    columns = ', '.join(name for name, _ in STAGING_COLUMNS)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert('copy {} ({}) from stdin with (format csv)'.format(tablename, columns), buf)
+    finally:
+        cursor.close()
+
+
+def estimate_rows(path):
+    """
+    Number of data rows recorded in the sheet dimensions, None if the writer left it out
+    """
+    with open_sheet(path) as (_, max_row):
+        return max_row - 1 if max_row else None
+
+
+def parse_month(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m')
+    except (TypeError, ValueError):
+        raise IngestError(u'月份格式错误, 应为"2019-08"格式: {}'.format(value))
+
+
+def peek_month(path):
+    """
+    Month of the first data row, found without reading the rest of the sheet
+    """
+    rows = iter_sheet_rows(path)
+    try:
+        values = next(rows, None)
+    finally:
+        rows.close()
+    if values is None:
+        raise IngestError(u'上传文件中没有数据。')
+    return parse_month(values[0])
+
+
+def stage_workbook(connection, path, tablename, chunk_rows=5000, progress=None):
+    """
+    Stream a monthly workbook into a new staging table, chunk_rows rows per COPY.
+    Must run inside the transaction that promotes the rows, the table is dropped on commit.
+    Peak memory only depends on chunk_rows, not on the size of the sheet.
+    progress, if given, is called with the number of rows staged after every chunk.
+    Returns the SheetStats collected on the way.
+    """
+    stats = SheetStats()
+    create_staging_table(connection, tablename)
+
+    chunk = []
+    for values in iter_sheet_rows(path):
+        if stats.month is None:
+            stats.month = parse_month(values[0])
+        stats.momo_numbers.add(values[1])
+        chunk.append(values)
+
+        if len(chunk) >= chunk_rows:
+            copy_rows(connection, tablename, chunk)
+            stats.row_count += len(chunk)
+            chunk = []
+            if progress:
+                progress(stats.row_count)
+
+    if chunk:
+        copy_rows(connection, tablename, chunk)
+        stats.row_count += len(chunk)
+        if progress:
+            progress(stats.row_count)
+
+    if stats.month is None:
+        raise IngestError(u'上传文件中没有数据。')
+    return stats
@@ -0,0 +1,229 @@
+# -*- coding: UTF-8 -*-
+import datetime
+
+from flask import current_app
+from sqlalchemy import exc, text
+
+from .. import db
+from ..database import disable_statement_timeout
+from ..models import ImportJob, ImportManifest
+from .helper import add_log
+from .ingest import stage_workbook, estimate_rows, peek_month, IngestError
+from .salary import update_salaries
+from .summary import refresh_summaries
+from .recalc import clear_month
+from .anchor_index import anchor_index
+from .repository import invalidate_payrolls
+
+CLAIM_JOB = """
+    update import_jobs set status = 'running', stage = 'staging', started = :now
+    where id = (select id from import_jobs
+                where status = 'queued'
+                order by id
+                limit 1
+                for update skip locked)
+    returning id
+    """
+
+PROMOTE_RAW_DATA = """
+    insert into payrolls (date, anchor_reward, coins, guild_division, anchor_momo, profit)
+    select date_trunc('month', to_date(月份, 'YYYY-MM')), 播主奖励, 总陌币, 公会分成金额, 陌陌号, 实际收入
+    from {}
+    """
+
+
+# a concurrent upload of the same file may have added the row first
+ADD_MANIFEST = """
+    insert into import_manifests (sha256, filename, path, size, status, created)
+    values (:sha256, :filename, :path, :size, 'stored', :now)
+    on conflict (sha256) do nothing
+    """
+
+
+def enqueue_import(user, filename, path, manifest=None):
+    """
+    Queue an uploaded monthly report for the background import worker
+    """
+    job = ImportJob(created=datetime.datetime.now(),
+                    user=user,
+                    filename=filename,
+                    path=path,
+                    status='queued',
+                    stage='queued',
+                    progress=0)
+    db.session.add(job)
+    if manifest is not None:
+        db.session.flush()
+        manifest.job_id = job.id
+        manifest.status = 'queued'
+        manifest.message = None
+        manifest.updated = job.created
+    db.session.commit()
+    return job
+
+
+# first key of the advisory locks on a payroll month, the second one is the month as yyyymm
+MONTH_LOCK = 1
+
+
+def lock_month(connection, month):
+    """
+    Hold the month until the transaction ends, so two imports of the same month
+    cannot both pass month_imported and both promote their rows
+    """
+    connection.execute(text('select pg_advisory_xact_lock(:key, :month)'),
+                       key=MONTH_LOCK, month=month.year * 100 + month.month)
+
+
+def month_imported(connection, month):
+    return connection.execute(text("select 1 from payrolls where date = :month limit 1"),
+                              month=month).first() is not None
+
+
+def month_imported_message(month):
+    return str(month.year) + '年' + str(month.month) + "月的工资表已在数据库, 请检查日期重新上传."
+
+
+def import_upload(user, filename, sha256, path, size):
+    """
+    Queue the import of a stored upload, unless the same content was imported already,
+    is being imported, or is for a month already in payrolls.
+    Returns (job, message), job is None when nothing was queued.
+    """
+    now = datetime.datetime.now()
+    db.session.execute(text(ADD_MANIFEST), dict(sha256=sha256, filename=filename, path=path, size=size, now=now))
+    # held until the job is queued or refused, a second upload of the file waits and finds it queued
+    manifest = ImportManifest.query.filter_by(sha256=sha256).populate_existing().with_for_update().one()
+    if manifest.status == 'success':
+        message = '该文件已于{:%Y-%m-%d %H:%M}导入 ({}年{}月, {}行), 无需重复上传。'.format(
+            manifest.updated, manifest.month.year, manifest.month.month, manifest.row_count)
+        # nothing changed, only the lock on the manifest is released
+        db.session.rollback()
+        return None, message
+    elif manifest.status == 'queued':
+        job = ImportJob.query.get(manifest.job_id)
+        db.session.rollback()
+        return job, '该文件正在导入。'
+
+    # refused from the first row, before the whole sheet is parsed
+    try:
+        manifest.month = peek_month(path)
+        if month_imported(db.session.connection(), manifest.month):
+            raise IngestError(month_imported_message(manifest.month))
+    except IngestError as e:
+        manifest.status, manifest.message, manifest.updated = 'failed', str(e), now
+        db.session.commit()
+        return None, str(e)
+
+    return enqueue_import(user, filename, path, manifest), '文件已上传, 正在后台导入。'
+
+
+def replay_import(user, sha256):
+    """
+    Queue a failed upload again from its stored file, returns the job or None if it cannot be replayed
+    """
+    manifest = ImportManifest.query.get(sha256)
+    if manifest is None or manifest.status != 'failed':
+        return None
+    return enqueue_import(user, manifest.filename, manifest.path, manifest)
+
+
+def claim_job():
+    """
+    Mark the oldest queued job as running and return its id, None if the queue is empty.
+    SKIP LOCKED lets several worker processes poll the same queue.
+    """
+    with db.engine.begin() as connection:
+        row = connection.execute(text(CLAIM_JOB), now=datetime.datetime.now()).first()
+    return row[0] if row else None
+
+
+def requeue_interrupted():
+    """
+    Put jobs left running by a stopped worker back in the queue; their import
+    transaction was rolled back with the connection so they can safely run again.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(text("""update import_jobs set status = 'queued', stage = 'queued', progress = 0
+                                   where status = 'running'"""))
+
+
+def update_job(job_id, **values):
+    # written on its own connection so the progress is visible while the
+    # import transaction is still open
+    table = ImportJob.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.update().where(table.c.id == job_id).values(**values))
+
+
+def finish_job(job_id, status, message, month=None, row_count=None):
+    now = datetime.datetime.now()
+    update_job(job_id, status=status, stage='done', message=message, finished=now)
+
+    # the manifest keeps the outcome of the latest import of the file
+    values = dict(status=status, message=message, updated=now)
+    if month is not None:
+        values.update(month=month, row_count=row_count)
+    table = ImportManifest.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.update().where(table.c.job_id == job_id).values(**values))
+
+
+def run_import(job_id):
+    """
+    Stage, validate and promote the sheet of an import job, then compute the salaries of its month
+    """
+    job = ImportJob.query.get(job_id)
+    # temporary table, gone once the import transaction ends
+    tablename = 'raw_data_{}_{}'.format(job.created.strftime('%Y%m%d_%H%M%S'), job.id)
+
+    update_job(job.id, total_rows=estimate_rows(job.path))
+
+    connection = db.engine.connect()
+    trans = connection.begin()
+    try:
+        disable_statement_timeout(connection)
+        # a month already imported is refused before the sheet is staged; an import
+        # of the same month running on another worker is waited for
+        month = peek_month(job.path)
+        lock_month(connection, month)
+        if month_imported(connection, month):
+            raise IngestError(month_imported_message(month))
+
+        stats = stage_workbook(connection, job.path, tablename,
+                               chunk_rows=current_app.config['UPLOAD_CHUNK_ROWS'],
+                               progress=lambda rows: update_job(job.id, progress=rows))
+        date_object = stats.month
+
+        update_job(job.id, stage='validating')
+        # check if all momo_number of raw data is available in anchor table
+        anchors = anchor_index()
+        invalid_number = sorted(n for n in stats.momo_numbers if n not in anchors)
+        if invalid_number:
+            raise IngestError(",\t".join(invalid_number) + " 不存在主播数据库中, 请检查陌陌号是否正确或添加新的主播。")
+
+        update_job(job.id, stage='promoting')
+        connection.execute(PROMOTE_RAW_DATA.format(tablename))
+
+        # update salary and penalty for newly added records
+        update_job(job.id, stage='salary')
+        update_salaries(connection, date_object)
+        refresh_summaries(connection, date_object)
+        clear_month(connection, date_object)
+        trans.commit()
+        invalidate_payrolls()
+
+        finish_job(job.id, 'success', '该文件已成功上传。', month=date_object, row_count=stats.row_count)
+        add_log(job.user, "Upload", target_table=tablename)
+
+    except IngestError as e:
+        trans.rollback()
+        finish_job(job.id, 'failed', str(e))
+
+    except exc.SQLAlchemyError as e:
+        trans.rollback()
+        finish_job(job.id, 'failed', str(getattr(e, 'orig', e)))
+        add_log(job.user, "Upload", target_table=tablename, status="F")
+
+    finally:
+        connection.close()
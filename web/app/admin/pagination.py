@@ -0,0 +1,125 @@
+# -*- coding: UTF-8 -*-
+import base64
+import datetime
+import json
+
+from flask import request, current_app
+from sqlalchemy import tuple_
+
+
+class KeysetPage(object):
+    """
+    One page of a keyset (seek) paginated listing
+    """
+    def __init__(self, items, next_cursor, sort, order, is_first):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.sort = sort
+        self.order = order
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        # isoformat leaves out the fraction when it is 0, and keeps the microseconds otherwise
+        fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value['dt'] else '%Y-%m-%dT%H:%M:%S'
+        return datetime.datetime.strptime(value['dt'], fmt)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Return the key values stored in a cursor, None if it cannot be read
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        return [_decode_value(v) for v in json.loads(raw.decode('utf-8'))]
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+def sort_args(sort_keys, default_sort, default_order='asc'):
+    """
+    Read the sort and order query arguments, falling back to the defaults for unknown values
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in sort_keys:
+        sort = default_sort
+    order = request.args.get('order', default_order)
+    if order not in ('asc', 'desc'):
+        order = default_order
+    return sort, order
+
+
+def _order_by(query, columns, order):
+    if order == 'desc':
+        return query.order_by(*[c.desc() for c in columns])
+    return query.order_by(*[c.asc() for c in columns])
+
+
+def _seek(query, columns, values, order):
+    if order == 'desc':
+        return query.filter(tuple_(*columns) < tuple_(*values))
+    return query.filter(tuple_(*columns) > tuple_(*values))
+
+
+def keyset_paginate(query, columns, key, sort, order, after=None, limit=None):
+    """
+    Return the page of query rows that follows the cursor `after`.
+
+    columns are the sort column and a unique (non null) tie breaker, key extracts the
+    same values from a result row. Rows are fetched with a WHERE (sort, id) > cursor
+    seek instead of OFFSET, so every page costs the same however deep it is.
+
+    A NULL sort value would make the row comparison NULL, so the rows without one
+    are paged apart on the tie breaker alone, where postgres sorts them: after the
+    others in ascending order, before them in descending order.
+    """
+    limit = limit or current_app.config['PAGE_SIZE']
+
+    values = decode_cursor(after) if after else None
+    if not values or len(values) != len(columns):
+        values = None
+
+    if len(columns) == 1:
+        segments = [(None, columns)]
+    else:
+        sort_column, ties = columns[0], columns[1:]
+        segments = [(sort_column.isnot(None), columns), (sort_column.is_(None), ties)]
+        if order == 'desc':
+            segments.reverse()
+        # the cursor row's segment is the first one left to page
+        if values is not None:
+            segments = segments[[s[1] is ties for s in segments].index(values[0] is None):]
+
+    rows = []
+    for i, (criterion, segment_columns) in enumerate(segments):
+        segment = query if criterion is None else query.filter(criterion)
+        if i == 0 and values is not None:
+            segment = _seek(segment, segment_columns, values[-len(segment_columns):], order)
+        segment = _order_by(segment, segment_columns, order)
+        rows.extend(segment.limit(limit + 1 - len(rows)).all())
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key(rows[-1]))
+
+    return KeysetPage(rows, next_cursor, sort, order, is_first=values is None)
@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+import datetime
+import itertools
+
+from flask import current_app
+from sqlalchemy import text, bindparam
+
+from .. import db
+from ..database import disable_statement_timeout
+from .repository import month_range, invalidate_payrolls
+from .salary import update_salaries
+from .summary import refresh_summaries
+
+# only payrolls that exist can be stale, a later import computes the others
+MARK_DIRTY = """
+    insert into salary_dirty (anchor_momo, month, marked)
+    select distinct anchor_momo, date, :now from payrolls
+    where anchor_momo in :momo_numbers {month_filter}
+    on conflict (anchor_momo, month) do update set marked = excluded.marked
+    """
+
+# taken out of the table by the transaction that recomputes them, so a crash
+# leaves them marked, and pairs being marked again by an uncommitted penalty are skipped
+CLAIM_DIRTY = """
+    delete from salary_dirty
+    where (anchor_momo, month) in (select anchor_momo, month from salary_dirty
+                                   order by month, anchor_momo
+                                   limit :batch for update skip locked)
+    returning anchor_momo, month
+    """
+
+
+def mark_dirty(connection, momo_numbers, date_object=None):
+    """
+    Mark the payrolls of the anchors in the month of date_object, in every month
+    if it is None, for a salary recalculation. Call it in the transaction that
+    changes their penalties or terms, so the mark is committed with the change.
+    """
+    if not momo_numbers:
+        return
+    params = dict(momo_numbers=tuple(momo_numbers), now=datetime.datetime.now())
+    month_filter = ''
+    if date_object is not None:
+        month_filter = 'and date = :month'
+        params['month'] = month_range(date_object)[0]
+    connection.execute(text(MARK_DIRTY.format(month_filter=month_filter))
+                       .bindparams(bindparam('momo_numbers', expanding=True)), **params)
+
+
+def dirty_count():
+    return db.session.execute(text('select count(*) from salary_dirty')).scalar()
+
+
+def clear_month(connection, date_object):
+    """
+    Unmark the payrolls of a month whose salaries were all just computed
+    """
+    connection.execute(text('delete from salary_dirty where month = :month'), month=month_range(date_object)[0])
+
+
+def recalculate_dirty(batch_size=None, max_batches=None):
+    """
+    Compute again the salaries and summaries of the marked payrolls, batch_size
+    (anchor, month) pairs per transaction, until none is left or max_batches ran.
+    Several processes may run it at once. Returns the number of pairs done.
+    """
+    batch_size = batch_size or current_app.config['SALARY_RECALC_BATCH']
+    done, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        with db.engine.begin() as connection:
+            disable_statement_timeout(connection)
+            pairs = connection.execute(text(CLAIM_DIRTY), batch=batch_size).fetchall()
+            by_month = sorted(pairs, key=lambda p: (p[1], p[0]))
+            for month, group in itertools.groupby(by_month, key=lambda p: p[1]):
+                momo_numbers = [momo for momo, _ in group]
+                update_salaries(connection, month, momo_numbers)
+                refresh_summaries(connection, month, momo_numbers)
+        if not pairs:
+            break
+        done += len(pairs)
+        batches += 1
+        invalidate_payrolls()
+    return done
@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+from sqlalchemy import func, select
+
+from ..cache import VersionedCache, bump_version
+from ..models import Penalty, Comment, PayrollMonthSummary
+
+_months = VersionedCache('payrolls')
+
+
+def month_range(date_object):
+    """
+    Return the [start, end) datetime window of the month containing date_object
+    """
+    start = date_object.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def penalties_in_month(momo_number, date_object):
+    """
+    Return the penalties of an anchor in the month of date_object, oldest first
+    """
+    start, end = month_range(date_object)
+    return Penalty.query.filter(Penalty.anchor_momo == momo_number,
+                                Penalty.date >= start, Penalty.date < end) \
+        .order_by(Penalty.date).all()
+
+
+def comments_in_month(momo_number, date_object):
+    """
+    Return the comments on an anchor in the month of date_object, oldest first
+    """
+    start, end = month_range(date_object)
+    return Comment.query.filter(Comment.anchor_momo == momo_number,
+                                Comment.date >= start, Comment.date < end) \
+        .order_by(Comment.date).all()
+
+
+def penalty_totals(date_object, momo_numbers=None):
+    """
+    Return a subquery of (anchor_momo, total) penalty sums for the month of date_object,
+    only of the given anchors if momo_numbers is set
+    """
+    start, end = month_range(date_object)
+    query = select([Penalty.anchor_momo, func.sum(Penalty.amount).label('total')]) \
+        .where(Penalty.date >= start) \
+        .where(Penalty.date < end)
+    if momo_numbers is not None:
+        query = query.where(Penalty.anchor_momo.in_(momo_numbers))
+    return query.group_by(Penalty.anchor_momo).alias('penalty_totals')
+
+
+def payroll_months():
+    """
+    Return the months that have payrolls, oldest first.
+    Read from the month summaries and cached per process until payrolls are imported.
+    """
+    return _months.get('months', lambda: [m for m, in PayrollMonthSummary.query
+                                          .with_entities(PayrollMonthSummary.month)
+                                          .order_by(PayrollMonthSummary.month)])
+
+
+def invalidate_payrolls():
+    """
+    Drop the caches built from payrolls in every process, call after payroll changes are committed
+    """
+    bump_version('payrolls')
@@ -0,0 +1,64 @@
+# -*- coding: UTF-8 -*-
+from psycopg2.extras import execute_values
+from sqlalchemy import func, select
+
+from ..models import Anchor, Payroll
+from .repository import month_range, penalty_totals
+
+# the anchor's percentage of the coins is paid at COIN_RATE yuan per coin,
+# anchors other than the aces keep PLATFORM_FEE_FACTOR of it after a 6% platform fee
+COIN_RATE = 0.1
+PLATFORM_FEE_FACTOR = 0.94
+
+
+def calculate_salary(coins, percentage, ace_anchor_or_not, penalty_sum):
+    """
+    Salary of a single payroll row
+    """
+    if ace_anchor_or_not:
+        return round(coins * percentage * COIN_RATE - penalty_sum, 2)
+    return round(coins * percentage * COIN_RATE * PLATFORM_FEE_FACTOR - penalty_sum, 2)
+
+
+SALARY_UPDATE = """
+    update payrolls set penalty = v.penalty, salary = v.salary
+    from (values %s) as v (id, penalty, salary)
+    where payrolls.id = v.id
+    """
+
+
+def update_salaries(connection, date_object, momo_numbers=None, page_size=1000):
+    """
+    Compute penalty and salary of every payroll in a month, only of the given anchors if momo_numbers is set.
+
+    The penalties of the month are summed once per anchor in a grouped join and the
+    results are written back with a paged multi-row update, instead of walking every
+    anchor's whole penalty history row by row. Rounding stays in python so the
+    figures match the ones produced by calculate_salary.
+    Returns the number of payroll rows updated.
+    """
+    start, _ = month_range(date_object)
+    totals = penalty_totals(start, momo_numbers)
+    query = select([Payroll.id, Payroll.coins, Anchor.percentage, Anchor.ace_anchor_or_not,
+                    func.coalesce(totals.c.total, 0)]) \
+        .select_from(Payroll.__table__
+                     .join(Anchor.__table__, Anchor.momo_number == Payroll.anchor_momo)
+                     .outerjoin(totals, totals.c.anchor_momo == Payroll.anchor_momo)) \
+        .where(Payroll.date == start)
+    if momo_numbers is not None:
+        query = query.where(Payroll.anchor_momo.in_(momo_numbers))
+    rows = connection.execute(query)
+
+    values = []
+    for payroll_id, coins, percentage, ace, penalty_sum in rows:
+        # an anchor edited with an empty percentage earns nothing rather than failing the import
+        salary = calculate_salary(coins or 0, percentage or 0, ace, penalty_sum)
+        values.append((payroll_id, penalty_sum, salary))
+
+    if values:
+        cursor = connection.connection.cursor()
+        try:
+            execute_values(cursor, SALARY_UPDATE, values, page_size=page_size)
+        finally:
+            cursor.close()
+    return len(values)
@@ -0,0 +1,35 @@
+# -*- coding: UTF-8 -*-
+import hashlib
+import os
+import tempfile
+
+
+def store_upload(stream, directory, suffix='.xlsx', chunk_size=1024 * 1024):
+    """
+    Copy an uploaded file into directory under the sha256 of its content.
+    The file is hashed while it is written, so it is read only once whatever its size.
+    Returns (sha256, path, size); a file already stored is kept and the copy dropped.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+        path = os.path.join(directory, digest.hexdigest() + suffix)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return digest.hexdigest(), path, size
@@ -0,0 +1,76 @@
+# -*- coding: UTF-8 -*-
+import datetime
+
+from sqlalchemy import text, bindparam
+
+from .repository import month_range
+
+REFRESH_ANCHOR_SUMMARIES = """
+    insert into payroll_anchor_summaries (anchor_momo, month, coins, guild_division, profit,
+                                          penalty, salary, penalty_count, comment_count, updated)
+    select p.anchor_momo, p.date,
+           sum(coalesce(p.coins, 0)), sum(coalesce(p.guild_division, 0)), sum(coalesce(p.profit, 0)),
+           sum(coalesce(p.penalty, 0)), sum(coalesce(p.salary, 0)),
+           coalesce(max(pc.n), 0), coalesce(max(cc.n), 0), :now
+    from payrolls p
+    left join (select anchor_momo, count(*) as n from penalties
+               where date >= :start and date < :end group by anchor_momo) pc on pc.anchor_momo = p.anchor_momo
+    left join (select anchor_momo, count(*) as n from comments
+               where date >= :start and date < :end group by anchor_momo) cc on cc.anchor_momo = p.anchor_momo
+    where p.date = :month {anchor_filter}
+    group by p.anchor_momo, p.date
+    on conflict (anchor_momo, month) do update
+    set coins = excluded.coins, guild_division = excluded.guild_division, profit = excluded.profit,
+        penalty = excluded.penalty, salary = excluded.salary, penalty_count = excluded.penalty_count,
+        comment_count = excluded.comment_count, updated = excluded.updated
+    """
+
+REFRESH_MONTH_SUMMARY = """
+    insert into payroll_month_summaries (month, anchor_count, ace_count, coins, guild_division, profit,
+                                         penalty, salary, ace_salary, non_ace_salary, updated)
+    select s.month, count(*), count(*) filter (where a.ace_anchor_or_not),
+           sum(s.coins), sum(s.guild_division), sum(s.profit), sum(s.penalty), sum(s.salary),
+           coalesce(sum(s.salary) filter (where a.ace_anchor_or_not), 0),
+           coalesce(sum(s.salary) filter (where not coalesce(a.ace_anchor_or_not, false)), 0),
+           :now
+    from payroll_anchor_summaries s
+    join anchors a on a.momo_number = s.anchor_momo
+    where s.month = :month
+    group by s.month
+    on conflict (month) do update
+    set anchor_count = excluded.anchor_count, ace_count = excluded.ace_count, coins = excluded.coins,
+        guild_division = excluded.guild_division, profit = excluded.profit, penalty = excluded.penalty,
+        salary = excluded.salary, ace_salary = excluded.ace_salary, non_ace_salary = excluded.non_ace_salary,
+        updated = excluded.updated
+    """
+
+
+def refresh_summaries(connection, date_object, momo_numbers=None):
+    """
+    Refresh the summary rows of a month, only those of the given anchors if momo_numbers is set.
+    The month total is rebuilt from the per-anchor rows, so an incremental refresh
+    never rescans the month's payrolls.
+    """
+    start, end = month_range(date_object)
+    params = dict(month=start, start=start, end=end, now=datetime.datetime.now())
+
+    query = text(REFRESH_ANCHOR_SUMMARIES.format(anchor_filter=''))
+    if momo_numbers is not None:
+        if not momo_numbers:
+            return
+        query = text(REFRESH_ANCHOR_SUMMARIES.format(anchor_filter='and p.anchor_momo in :momo_numbers')) \
+            .bindparams(bindparam('momo_numbers', expanding=True))
+        params['momo_numbers'] = list(momo_numbers)
+
+    connection.execute(query, **params)
+    connection.execute(text(REFRESH_MONTH_SUMMARY), month=start, now=params['now'])
+
+
+def refresh_all_summaries(connection):
+    """
+    Rebuild the summaries of every month found in payrolls, returns the months refreshed
+    """
+    months = [r[0] for r in connection.execute(text("select distinct date from payrolls where date is not null"))]
+    for month in months:
+        refresh_summaries(connection, month)
+    return months
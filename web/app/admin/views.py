@@ -1,23 +1,68 @@
 # -*- coding: UTF-8 -*-
 import os
-from flask import abort, flash, redirect, render_template, url_for, request
+from flask import abort, current_app, flash, redirect, render_template, url_for, request, jsonify, \
+    Response, stream_with_context
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
 import datetime
 import string
-import pandas as pd
-from sqlalchemy import create_engine, exc, desc
+from sqlalchemy import create_engine, exc, desc, func, or_
+from sqlalchemy.orm import contains_eager
 import psycopg2
-import re
-from bokeh.embed import components
 
 from . import admin
 from .forms import DepartmentForm, RoleForm, EmployeeAssignForm, AnchorForm, \
     SearchForm, UploadForm, SearchPayrollForm, SearchPayrollByAnchorForm, \
-    SearchPayrollByMonthForm, PayrollForm, CommentForm, RegistrationForm
-from .. import db
-from ..models import Department, Role, Employee, Anchor, Payroll, Comment
-from .helper import get_system_info, create_line_chart, add_log
+    SearchPayrollByMonthForm, PayrollForm, CommentForm, BulkCommentForm, RegistrationForm
+from .. import db, audit_log, db_pool, profiler, login_guard, background, fragments
+from ..identity import invalidate_identities
+from ..models import Department, Role, Employee, Anchor, Payroll, Comment, ImportJob, \
+    ImportManifest, PayrollMonthSummary
+from .helper import get_system_info, salary_history_chart, add_log
+from .jobs import import_upload, replay_import
+from .store import store_upload
+from .anchor_index import find_anchor, invalidate_anchor_index
+from .pagination import keyset_paginate, sort_args
+from .summary import refresh_summaries
+from .repository import penalties_in_month, comments_in_month, payroll_months, month_range
+from .export import export_query, export_count, iter_rows, iter_csv, iter_xlsx
+from .bulk import submitted_rows, parse_comment, insert_rows, id_range
+from .recalc import mark_dirty, dirty_count, recalculate_dirty
+
+# sort keys of the paginated listings: the sort columns (with the id as tie
+# breaker) and how to read the same values back from the last row of a page
+ANCHOR_SORTS = {
+    'id': [Anchor.id],
+    'name': [Anchor.name, Anchor.id],
+    'momo_number': [Anchor.momo_number, Anchor.id],
+}
+ANCHOR_KEYS = {
+    'id': lambda a: [a.id],
+    'name': lambda a: [a.name, a.id],
+    'momo_number': lambda a: [a.momo_number, a.id],
+}
+
+PAYROLL_SORTS = {
+    'momo_number': [Payroll.anchor_momo, Payroll.id],
+    'name': [Anchor.name, Payroll.id],
+    'coins': [func.coalesce(Payroll.coins, 0), Payroll.id],
+    'salary': [func.coalesce(Payroll.salary, 0), Payroll.id],
+}
+PAYROLL_KEYS = {
+    'momo_number': lambda p: [p.anchor_momo, p.id],
+    'name': lambda p: [p.host.name, p.id],
+    'coins': lambda p: [p.coins or 0, p.id],
+    'salary': lambda p: [p.salary or 0, p.id],
+}
+
+COMMENT_SORTS = {
+    'date': [Comment.date, Comment.id],
+    'momo_number': [Comment.anchor_momo, Comment.id],
+}
+COMMENT_KEYS = {
+    'date': lambda c: [c.date, c.id],
+    'momo_number': lambda c: [c.anchor_momo, c.id],
+}
 
 def check_admin():
     """
@@ -45,6 +90,7 @@ def register():
         try:
             db.session.add(employee)
             db.session.commit()
+            invalidate_identities()
             flash('该员工成功登记', 'success')
 
             add_log(current_user.username, "Add", 
@@ -132,6 +178,7 @@ def edit_department(id):
         department.name = form.name.data
         department.description = form.description.data
         db.session.commit()
+        invalidate_identities()
         flash('You have successfully edited the department.')
 
         add_log(current_user.username, "Update", target_id=id, 
@@ -159,6 +206,7 @@ def delete_department(id):
     d_name = department.name
     db.session.delete(department)
     db.session.commit()
+    invalidate_identities()
     flash('You have successfully deleted the department.')
 
     add_log(current_user.username, "Delete", target_id=d_name, target_table="departments")
@@ -233,6 +281,7 @@ def edit_role(id):
         role.description = form.description.data
         db.session.add(role)
         db.session.commit()
+        invalidate_identities()
         flash('You have successfully edited the role.')
 
         add_log(current_user.username, "Update", target_id=id, 
@@ -259,6 +308,7 @@ def delete_role(id):
     r_name = role.name
     db.session.delete(role)
     db.session.commit()
+    invalidate_identities()
     flash('You have successfully deleted the role.')
 
     add_log(current_user.username, "Delete", target_id=r_name, 
@@ -302,6 +352,7 @@ def assign_employee(id):
         employee.is_admin = form.is_admin.data
         db.session.add(employee)
         db.session.commit()
+        invalidate_identities()
         flash('You have successfully assigned a department and role.')
 
         add_log(current_user.username, "Update", target_id=id, 
@@ -322,9 +373,17 @@ def list_anchors():
     """
     List all anchors
     """
-    anchors = Anchor.query.all()
+    sort, order = sort_args(ANCHOR_SORTS, 'id')
+    q = request.args.get('q', '').strip()
+
+    query = Anchor.query
+    if q:
+        query = query.filter(or_(Anchor.name.contains(q), Anchor.momo_number.startswith(q)))
+
+    page = keyset_paginate(query, ANCHOR_SORTS[sort], ANCHOR_KEYS[sort], sort, order,
+                           after=request.args.get('after'))
     return render_template('admin/anchors/anchors.html',
-                           anchors=anchors, title='Anchors')
+                           anchors=page.items, page=page, q=q, title='Anchors')
 
 
 @admin.route('/anchors/add_anchor', methods=['GET', 'POST'])
@@ -360,6 +419,7 @@ def add_anchor():
         try:
             db.session.add(anchor)
             db.session.commit()
+            invalidate_anchor_index()
 
             upload_folder = os.getenv('UPLOAD_FOLDER')
             directory = upload_folder + "/" + form.momo_number.data
@@ -386,6 +446,14 @@ def add_anchor():
                            title="Add Anchor")
 
 
+def salary_terms(anchor):
+    """
+    The anchor attributes calculate_salary uses, the form sets the percentage as a Decimal
+    """
+    percentage = float(anchor.percentage) if anchor.percentage is not None else None
+    return percentage, bool(anchor.ace_anchor_or_not)
+
+
 @admin.route('/anchors/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_anchor(id):
@@ -399,6 +467,8 @@ def edit_anchor(id):
     anchor = Anchor.query.get_or_404(id)
     form = AnchorForm(obj=anchor)
     if form.validate_on_submit():
+        # the terms the salaries of the anchor's payrolls were computed with
+        terms = salary_terms(anchor)
         anchor.name = form.name.data
         anchor.entry_time = form.entry_time.data
         anchor.address = form.address.data
@@ -421,7 +491,10 @@ def edit_anchor(id):
             f.save(os.path.join(upload_folder, form.momo_number.data, filename))
 
         db.session.add(anchor)
+        if salary_terms(anchor) != terms:
+            mark_dirty(db.session.connection(), [anchor.momo_number])
         db.session.commit()
+        invalidate_anchor_index()
         flash('你已成功修改一个主播记录。')
 
         add_log(current_user.username, 
@@ -462,6 +535,7 @@ def delete_anchor(id, action, name):
         anchor = Anchor.query.get_or_404(id)
         db.session.delete(anchor)
         db.session.commit()
+        invalidate_anchor_index()
 
         add_log(current_user.username, 
                 "Delete", target_id=id, target_table="anchors")
@@ -481,97 +555,54 @@ def upload():
 
     form = UploadForm()
 
-    # retrieve all existing dates in payrolls table
-    existing_dates = Payroll.query.with_entities(Payroll.date).distinct().all()
-    dates_list = [d[0] for d in existing_dates]
-
-    # retrieve all momo_numbers in anchors table
-    momo_numbers = Anchor.query.with_entities(Anchor.momo_number).all()
-    nm_list = [n[0] for n in momo_numbers]
-
     if form.validate_on_submit():
         f = form.upload_file.data
-        filename = f.filename
-        filename = datetime.datetime.today().strftime('%Y%m%d_%H%M%S') + filename.replace('-', '')
-
-        upload_folder = os.getenv('UPLOAD_FOLDER')
-        path_name = os.path.join(upload_folder, 'table_store', filename)
-        if not os.path.exists(path_name):
-            f.save(path_name)
-            df = pd.read_excel(path_name, encoding = "utf-8")
-
-            # date cleaning
-            df = df.rename(columns=lambda x: re.sub(u'\(元\)', '', x))
-
-            # python 2 cannot deal with 'str' and 'unicode' comparision in pandas, but python 3 can handle it
-            df = df.drop(df[df["结算方式"] == "对私"].index)
-
-            # check date
-            date_object = datetime.datetime.strptime(df.iloc[0]['月份'], "%Y-%m")
-
-            # check if all momo_number of raw data is available in anchor table
-            df_numbers = list(df['陌陌号'])
-            invalid_number = []
-            for num in df_numbers:
-                if str(num) not in nm_list:
-                    invalid_number.append(str(num))
-
-            if date_object in dates_list:
-                msg = str(date_object.year) + '年' + str(date_object.month) + "月的工资表已在数据库, 请检查日期重新上传."
-                #os.remove(path_name)
-                flash(msg, 'error')
-            elif invalid_number:
-                nums = ",	".join(invalid_number)
-                #os.remove(path_name)
-                msg = nums + " 不存在主播数据库中, 请检查陌陌号是否正确或添加新的主播。"
-                flash(msg, 'error')
-            else:
-                engine = db.engine
-
-                tablename = 'raw_data_' + datetime.datetime.today().strftime('%Y%m%d_%H%M%S')
-                df.to_sql(tablename, engine)
-
-                connection = engine.connect()
-                trans = connection.begin()
-                try:
-                    query = """insert into payrolls (date, anchor_reward, coins, guild_division, anchor_momo, profit) 
-                                select  date_trunc('month', to_date(月份, 'YYYY-MM')), 播主奖励, 总陌币, 公会分成金额, 陌陌号, 实际收入 
-                                from {}""".format(tablename)
-                    connection.execute(query)
-                    trans.commit()
-
-                    # update salary and penalty for newly added records
-                    for payroll in Payroll.query.filter_by(date=date_object).all():
-                        penalties = payroll.host.penalties
-                        penalty_sum = 0
-                        for p in penalties:
-                            if p.date.year == date_object.year and p.date.month == date_object.month:
-                                penalty_sum += p.amount
-
-                        payroll.penalty = penalty_sum
-                        if payroll.host.ace_anchor_or_not:
-                            payroll.salary = round(payroll.coins * payroll.host.percentage * 0.1 - penalty_sum, 2)
-                        else:
-                            payroll.salary = round(payroll.coins * payroll.host.percentage * 0.1 * 0.94 - penalty_sum, 2)
-                    db.session.commit()
-
-                    add_log(current_user.username, "Upload", target_table=tablename)
-
-                    flash('该文件已成功上传。')
-
-                except exc.SQLAlchemyError as e:
-                    trans.rollback()
-                    db.session.rollback()
-                    add_log(current_user.username, "Upload", target_table=tablename, status="F")
-                    error = str(e.__dict__['orig'])
-                    flash(error, 'error')
-
-                finally:
-                    #os.remove(path_name)
-                    connection.close()
-        else:
-            flash("该文件已存在。", 'error')
-    return render_template('admin/upload.html', form=form,  title="Upload")
+
+        # stored under the hash of its content, the same workbook is never imported twice
+        store = os.path.join(os.getenv('UPLOAD_FOLDER'), 'table_store')
+        sha256, path_name, size = store_upload(f.stream, store)
+        job, message = import_upload(current_user.username, f.filename, sha256, path_name, size)
+
+        flash(message, 'info' if job else 'error')
+        if job:
+            return redirect(url_for('admin.upload', job=job.id))
+        return redirect(url_for('admin.upload'))
+
+    job = None
+    if request.args.get('job', type=int):
+        job = ImportJob.query.get(request.args.get('job', type=int))
+    manifests = ImportManifest.query.order_by(desc(ImportManifest.created)).limit(10).all()
+    return render_template('admin/upload.html', form=form, job=job, manifests=manifests, title="Upload")
+
+
+@admin.route('/upload/manifests/<sha256>/replay', methods=['POST'])
+@login_required
+def replay_upload(sha256):
+    """
+    Import a failed upload again from the stored file
+    """
+    check_admin()
+
+    job = replay_import(current_user.username, sha256)
+    if job is None:
+        flash('只能重新导入失败的文件。', 'error')
+        return redirect(url_for('admin.upload'))
+
+    add_log(current_user.username, "Replay", target_id=sha256, target_table="import_manifests")
+    flash('正在重新导入该文件。')
+    return redirect(url_for('admin.upload', job=job.id))
+
+
+@admin.route('/upload/jobs/<int:id>')
+@login_required
+def import_job_status(id):
+    """
+    Report the progress of an import job, polled by the upload page
+    """
+    check_admin()
+
+    job = ImportJob.query.get_or_404(id)
+    return jsonify(job.to_dict())
 
 
 @admin.route('/search', methods=['GET', 'POST'])
@@ -589,14 +620,15 @@ def search():
 
     # form to search the anchor salary information on a specific month
     anchor_payroll_form = SearchPayrollForm(request.form)
-    anchor_payroll_form.date.choices = [(int(d[0].strftime('%Y%m')), int(d[0].strftime('%Y%m'))) for d in Payroll.query.with_entities(Payroll.date).order_by(Payroll.date).distinct()]
+    months = [(int(d.strftime('%Y%m')), int(d.strftime('%Y%m'))) for d in payroll_months()]
+    anchor_payroll_form.date.choices = months
     if anchor_payroll_form.submit2.data and anchor_payroll_form.validate_on_submit():
         return redirect((url_for('admin.search_payroll_result', 
                         query=anchor_payroll_form.search.data.strip(), date=anchor_payroll_form.date.data)))
 
     # form to search the monthly payroll table for all anchors
     monthly_payroll_form = SearchPayrollByMonthForm(request.form)
-    monthly_payroll_form.date.choices = [(int(d[0].strftime('%Y%m')), int(d[0].strftime('%Y%m'))) for d in Payroll.query.with_entities(Payroll.date).order_by(Payroll.date).distinct()]
+    monthly_payroll_form.date.choices = months
     if monthly_payroll_form.submit3.data and monthly_payroll_form.validate_on_submit():
         date = datetime.datetime.strptime(str(monthly_payroll_form.date.data), "%Y%m")
         return redirect((url_for('admin.list_payrolls_by_month',
@@ -616,7 +648,8 @@ def search():
 @admin.route('/anchor_results/<query>')
 @login_required
 def anchor_search_result(query):
-    result = Anchor.query.filter_by(momo_number=query).first()
+    entry = find_anchor(query)
+    result = Anchor.query.get(entry.id) if entry else None
     if not result:
         flash('该陌陌号在主播表中没有记录')
         return redirect(url_for('admin.search'))
@@ -637,7 +670,9 @@ def search_payroll_result(query, date):
     check_admin()
 
     date = datetime.datetime.strptime(date, '%Y%m')
-    payroll = Payroll.query.filter_by(anchor_momo=query).filter_by(date=date).first()
+    payroll = None
+    if find_anchor(query):
+        payroll = Payroll.query.filter_by(anchor_momo=query).filter_by(date=date).first()
     if not payroll:
         flash('没有相关检索结果, 请检查主播陌陌号和其工作月份是否相符。')
         return redirect(url_for('admin.search'))
@@ -654,17 +689,8 @@ def search_payroll_result(query, date):
         form.percentage.data = payroll.host.percentage
         form.ace_anchor_or_not.data = payroll.host.ace_anchor_or_not
 
-        penalties = payroll.host.penalties
-        ps = []
-        for p in penalties:
-            if p.date.year == date.year and p.date.month == date.month:
-                ps.append((p.date, p.amount))
-
-        comments = payroll.host.comments
-        cms = []
-        for c in comments:
-            if c.date.year == date.year and c.date.month == date.month:
-                cms.append((c.date, c.comment))
+        ps = [(p.date, p.amount) for p in penalties_in_month(query, date)]
+        cms = [(c.date, c.comment) for c in comments_in_month(query, date)]
 
         salary = payroll.salary
     return render_template('admin/search/results/result.html', query=query, form=form, 
@@ -678,42 +704,89 @@ def list_payrolls_by_month(date):
     """
     List all payrolls on a specific month
     """
-    payrolls = Payroll.query.filter_by(date=date).order_by(desc(Payroll.date)).all()
-    salary_total = round(sum([p.salary for p in payrolls]), 2)
+    sort, order = sort_args(PAYROLL_SORTS, 'momo_number')
+    q = request.args.get('q', '').strip()
+
+    query = Payroll.query.join(Payroll.host).options(contains_eager(Payroll.host)).filter(Payroll.date == date)
+    if q:
+        query = query.filter(or_(Anchor.name.contains(q), Payroll.anchor_momo.startswith(q)))
+
+    page = keyset_paginate(query, PAYROLL_SORTS[sort], PAYROLL_KEYS[sort], sort, order,
+                           after=request.args.get('after'))
+
+    # the total covers the whole month, not only the rows on this page
+    summary = PayrollMonthSummary.query.get(date)
+    salary_total = round(summary.salary if summary else 0, 2)
 
     date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S") 
     year = date_obj.year
     month = date_obj.month
     return render_template('admin/search/results/payrolls.html',
-                           payrolls=payrolls, year=year, month=month, 
+                           payrolls=page.items, page=page, q=q, date=date,
+                           year=year, month=month,
                            salary_total=salary_total, title='Payrolls')
 
 
 @admin.route('/search_by_anchor/<query>')
 @login_required
 def search_by_anchor(query):
-    result = Payroll.query.filter_by(anchor_momo=query).order_by(desc(Payroll.date)).all()
+    entry = find_anchor(query)
+    result = Payroll.query.filter_by(anchor_momo=query).order_by(desc(Payroll.date)).all() if entry else None
 
     if not result:
         flash('该陌陌号在工资表中没有记录')
         return redirect(url_for('admin.search'))
 
     # plot a chart for the payroll history of an anchor
-    name = Anchor.query.filter_by(momo_number=query).first().name
-    engine = db.engine
-    query = "select date, salary from payrolls where anchor_momo = {}::varchar(30) order by date;".format(query)
-    df = pd.read_sql_query(query, engine)
-    engine.dispose()
-
-    title = name + "工资历史纪录"
-    plot = create_line_chart(df, title)
-    script, div = components(plot)
-    
+    name = entry.name
+    script, div = salary_history_chart(query, name)
+
     return render_template('admin/search/results/all_payrolls_anchor.html', 
-                            pays=result, name=name, 
+                            pays=result, name=name, momo_number=query,
                             the_div=div, the_script=script)
 
 
+@admin.route('/export/payrolls')
+@login_required
+def export_payrolls():
+    """
+    Stream payrolls as CSV or XLSX, of one month (month=YYYYMM), a range of months
+    (start=YYYYMM&end=YYYYMM, both included) and/or one anchor (anchor=momo number).
+    CSV starts sending at once. A workbook is only sent once it is complete, so an
+    XLSX export of more than EXPORT_XLSX_MAX_ROWS rows is redirected to the CSV one.
+    """
+    check_admin()
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'xlsx'):
+        abort(400)
+    try:
+        start = request.args.get('start', request.args.get('month'))
+        end = request.args.get('end', request.args.get('month'))
+        start = datetime.datetime.strptime(start, '%Y%m') if start else None
+        end = month_range(datetime.datetime.strptime(end, '%Y%m'))[1] if end else None
+    except ValueError:
+        abort(400)
+    momo_number = request.args.get('anchor') or None
+
+    query = export_query(start, end, momo_number)
+    if fmt == 'xlsx' and export_count(query) > current_app.config['EXPORT_XLSX_MAX_ROWS']:
+        return redirect(url_for('admin.export_payrolls', **dict(request.args.to_dict(), format='csv')))
+
+    rows = iter_rows(query)
+    name = 'payrolls_{}_{}{}'.format(start.strftime('%Y%m') if start else 'all',
+                                     (end - datetime.timedelta(days=1)).strftime('%Y%m') if end else 'all',
+                                     '_' + secure_filename(momo_number) if momo_number else '')
+    add_log(current_user.username, "Export", target_id=momo_number, target_table="payrolls")
+
+    if fmt == 'csv':
+        return Response(stream_with_context(iter_csv(rows)), mimetype='text/csv; charset=utf-8',
+                        headers={'Content-Disposition': 'attachment; filename={}.csv'.format(name)})
+    return Response(stream_with_context(iter_xlsx(rows)),
+                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    headers={'Content-Disposition': 'attachment; filename={}.xlsx'.format(name)})
+
+
 @admin.route('/comments')
 @login_required
 def list_comments():
@@ -722,9 +795,18 @@ def list_comments():
     """
     check_admin()
 
-    comments = Comment.query.order_by(Comment.date.desc()).all()
+    sort, order = sort_args(COMMENT_SORTS, 'date', 'desc')
+    q = request.args.get('q', '').strip()
+
+    # comments without an anchor are listed too
+    query = Comment.query.outerjoin(Comment.host).options(contains_eager(Comment.host))
+    if q:
+        query = query.filter(or_(Anchor.name.contains(q), Comment.anchor_momo.startswith(q)))
+
+    page = keyset_paginate(query, COMMENT_SORTS[sort], COMMENT_KEYS[sort], sort, order,
+                           after=request.args.get('after'))
     return render_template('admin/comments/comments.html',
-                           comments=comments, title='备注')
+                           comments=page.items, page=page, q=q, title='备注')
 
 
 @admin.route('/add_comment', methods=['GET', 'POST'])
@@ -738,6 +820,12 @@ def add_comment():
     form = CommentForm()
 
     if form.validate_on_submit():
+        if not find_anchor(form.momo_number.data.strip()):
+            flash(u'错误:此陌陌号不存在, 请验证输入的陌陌号重试', 'error')
+            add_log(current_user.username,
+                    "Add", target_table="comments", status="F")
+            return redirect(url_for('admin.list_comments'))
+
         comment = Comment(
             anchor_momo=form.momo_number.data.strip(),
             date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
@@ -745,6 +833,8 @@ def add_comment():
         )
         try:
             db.session.add(comment)
+            db.session.flush()
+            refresh_summaries(db.session.connection(), datetime.datetime.today(), [comment.anchor_momo])
             db.session.commit()
 
             flash(u'此备注记录已成功录入')
@@ -764,8 +854,73 @@ def add_comment():
                             title="Add Comment")
 
 
+@admin.route('/add_comment/bulk', methods=['GET', 'POST'])
+@login_required
+def add_comments():
+    """
+    Add many comments at once, from a pasted table or a CSV file
+    """
+    check_admin()
+
+    form = BulkCommentForm()
+    report = None
+
+    if form.validate_on_submit():
+        rows = submitted_rows(form, parse_comment)
+        if not rows:
+            flash(u'错误:没有可录入的备注记录', 'error')
+            return render_template('admin/comments/add_comments.html', form=form,
+                                   report=report, title="Add Comments")
+
+        now = datetime.datetime.now().replace(second=0, microsecond=0)
+        try:
+            report, ids = insert_rows(db.session.connection(), Comment.__table__, 'comment', rows, now)
+            db.session.commit()
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            flash(u'错误:备注记录录入失败, 请重试', 'error')
+            add_log(current_user.username, "Bulk Add", target_table="comments", status="F")
+        else:
+            flash(u'已录入{}条备注记录, {}条有误未录入'.format(len(ids), len(report) - len(ids)))
+            add_log(current_user.username, "Bulk Add", target_id=id_range(ids),
+                    target_table="comments", status="S" if ids else "F")
+
+    return render_template('admin/comments/add_comments.html', form=form,
+                           report=report, title="Add Comments")
+
+
 @admin.route('/system')
 @login_required
 def system_info():
+    check_admin()
+
     used_cpu_percent, used_disk_percent, free_disk_size = get_system_info()
-    return render_template('admin/system.html', cpu=used_cpu_percent, disk=used_disk_percent, free=free_disk_size)
+    return render_template('admin/system.html', cpu=used_cpu_percent, disk=used_disk_percent, free=free_disk_size,
+                           audit=audit_log.stats(), pool=db_pool.stats(), tasks=background.stats(),
+                           stale_salaries=dirty_count(), profile=profiler.stats() if profiler.enabled else None)
+
+
+@admin.route('/system/salaries/recalculate', methods=['POST'])
+@login_required
+def recalculate_salaries():
+    """
+    Compute the stale salaries now instead of waiting for an idle import worker
+    """
+    check_admin()
+
+    background.submit(recalculate_dirty)
+    add_log(current_user.username, "Recalculate", target_table="payrolls")
+    flash('正在重新计算工资。')
+    return redirect(url_for('admin.system_info'))
+
+
+@admin.route('/system/metrics')
+@login_required
+def system_metrics():
+    """
+    Dump the metrics of this worker process as JSON
+    """
+    check_admin()
+
+    return jsonify(audit_log=audit_log.stats(), db_pool=db_pool.stats(), login=login_guard.stats(),
+                   background=background.stats(), fragments=fragments.stats(), requests=profiler.stats() if profiler.enabled else None)
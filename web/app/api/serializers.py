@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+from collections import OrderedDict
+
+
+class FieldError(ValueError):
+    """
+    Raised when a request selects a field the resource does not have
+    """
+    pass
+
+
+def _month(value):
+    return value.strftime('%Y-%m') if value else None
+
+
+def _datetime(value):
+    return value.isoformat() if value else None
+
+
+# field name -> value of a model object, in output order
+ANCHOR_FIELDS = OrderedDict([
+    ('id', lambda a: a.id),
+    ('momo_number', lambda a: a.momo_number),
+    ('name', lambda a: a.name),
+    ('entry_time', lambda a: _datetime(a.entry_time)),
+    ('mobile_number', lambda a: a.mobile_number),
+    ('id_number', lambda a: a.id_number),
+    ('address', lambda a: a.address),
+    ('agent', lambda a: a.agent),
+    ('basic_salary_or_not', lambda a: a.basic_salary_or_not),
+    ('basic_salary', lambda a: a.basic_salary),
+    ('percentage', lambda a: a.percentage),
+    ('ace_anchor_or_not', lambda a: a.ace_anchor_or_not),
+    ('live_time', lambda a: a.live_time),
+    ('live_session', lambda a: a.live_session),
+])
+
+PAYROLL_FIELDS = OrderedDict([
+    ('id', lambda p: p.id),
+    ('month', lambda p: _month(p.date)),
+    ('momo_number', lambda p: p.anchor_momo),
+    ('name', lambda p: p.host.name),
+    ('coins', lambda p: p.coins),
+    ('guild_division', lambda p: p.guild_division),
+    ('anchor_reward', lambda p: p.anchor_reward),
+    ('profit', lambda p: p.profit),
+    ('penalty', lambda p: p.penalty),
+    ('salary', lambda p: p.salary),
+    ('percentage', lambda p: p.host.percentage),
+    ('ace_anchor_or_not', lambda p: p.host.ace_anchor_or_not),
+])
+
+PENALTY_FIELDS = OrderedDict([
+    ('date', lambda p: _datetime(p.date)),
+    ('amount', lambda p: p.amount),
+])
+
+COMMENT_FIELDS = OrderedDict([
+    ('date', lambda c: _datetime(c.date)),
+    ('comment', lambda c: c.comment),
+])
+
+
+def select_fields(available, requested):
+    """
+    Return the (name, getter) pairs named in the comma separated `requested`, all of them if it is empty
+    """
+    if not requested:
+        return list(available.items())
+    names = [n.strip() for n in requested.split(',') if n.strip()]
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        raise FieldError('unknown fields: {}; available: {}'.format(', '.join(unknown), ', '.join(available)))
+    return [(n, available[n]) for n in names]
+
+
+def serialize(obj, fields):
+    return {name: getter(obj) for name, getter in fields}
@@ -0,0 +1,226 @@
+# -*- coding: UTF-8 -*-
+import datetime
+import functools
+import hashlib
+import json
+
+from flask import current_app, request
+from flask_login import current_user
+from sqlalchemy import desc, func, or_
+from sqlalchemy.orm import contains_eager
+
+from . import api
+from .serializers import ANCHOR_FIELDS, PAYROLL_FIELDS, PENALTY_FIELDS, COMMENT_FIELDS, \
+    FieldError, select_fields, serialize
+from .. import db
+from ..models import Anchor, Payroll, PayrollAnchorSummary, PayrollMonthSummary
+from ..admin.anchor_index import find_anchor
+from ..admin.pagination import keyset_paginate, sort_args
+from ..admin.repository import penalties_in_month, comments_in_month
+from ..admin.views import ANCHOR_SORTS, ANCHOR_KEYS, PAYROLL_SORTS, PAYROLL_KEYS
+
+# part of every ETag, bump it when the representation of a resource changes
+REPRESENTATION = 1
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+@api.errorhandler(ApiError)
+def api_error(e):
+    return json_response({'error': e.message}, e.status)
+
+
+@api.errorhandler(FieldError)
+def field_error(e):
+    return json_response({'error': str(e)}, 400)
+
+
+def json_response(body, status=200):
+    return current_app.response_class(json.dumps(body, ensure_ascii=False, separators=(',', ':')),
+                                      status=status, mimetype='application/json')
+
+
+def admin_required(view):
+    """
+    Like login_required and check_admin, with JSON errors instead of a redirect to the login page
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError(401, 'login required')
+        if not current_user.is_admin:
+            raise ApiError(403, 'admin only')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def conditional(build, *stamps):
+    """
+    Answer 304 if the client holds the current representation, otherwise call build for the body.
+
+    The strong ETag is derived from the request URL and stamps read from the database
+    (row counts and last update times of the data the body is built from), so an
+    unchanged resource is recognised before it is queried, and every host gives
+    the same tag for the same data.
+    """
+    parts = [REPRESENTATION, request.full_path] + [str(stamp) for stamp in stamps]
+    tag = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    if request.if_none_match.contains(tag):
+        response = current_app.response_class(status=304)
+    else:
+        response = json_response(build())
+    response.set_etag(tag)
+    # may be stored, but must be revalidated before every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def anchors_stamp():
+    # an added anchor raises the count and the highest id, a deleted one lowers the count
+    return db.session.query(func.count(Anchor.id), func.max(Anchor.id), func.max(Anchor.updated)).one()
+
+
+def anchor_stamp(entry):
+    return entry.id, db.session.query(Anchor.updated).filter_by(id=entry.id).scalar()
+
+
+def parse_month(value):
+    for fmt in ('%Y%m', '%Y-%m'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ApiError(400, 'month must be YYYYMM or YYYY-MM: {}'.format(value))
+
+
+def page_limit():
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def page_body(page, fields):
+    return {'items': [serialize(item, fields) for item in page.items], 'next': page.next_cursor,
+            'sort': page.sort, 'order': page.order}
+
+
+def get_anchor(momo_number):
+    entry = find_anchor(momo_number)
+    if entry is None:
+        raise ApiError(404, 'no anchor with momo number {}'.format(momo_number))
+    return entry
+
+
+@api.route('/anchors')
+@admin_required
+def list_anchors():
+    """
+    Anchors, filtered by q on the name or momo number prefix, one cursor page at a time
+    """
+    fields = select_fields(ANCHOR_FIELDS, request.args.get('fields'))
+    sort, order = sort_args(ANCHOR_SORTS, 'id')
+    q = request.args.get('q', '').strip()
+
+    def build():
+        query = Anchor.query
+        if q:
+            query = query.filter(or_(Anchor.name.contains(q), Anchor.momo_number.startswith(q)))
+        page = keyset_paginate(query, ANCHOR_SORTS[sort], ANCHOR_KEYS[sort], sort, order,
+                               after=request.args.get('after'), limit=page_limit())
+        return page_body(page, fields)
+
+    return conditional(build, anchors_stamp())
+
+
+@api.route('/anchors/<momo_number>')
+@admin_required
+def get_anchor_detail(momo_number):
+    fields = select_fields(ANCHOR_FIELDS, request.args.get('fields'))
+    entry = get_anchor(momo_number)
+    return conditional(lambda: serialize(Anchor.query.get(entry.id), fields), anchor_stamp(entry))
+
+
+@api.route('/anchors/<momo_number>/payrolls')
+@admin_required
+def list_anchor_payrolls(momo_number):
+    """
+    Every payroll of an anchor, newest first
+    """
+    fields = select_fields(PAYROLL_FIELDS, request.args.get('fields'))
+    entry = get_anchor(momo_number)
+
+    # every change of the anchor's payrolls refreshes its summary rows
+    stamp = db.session.query(func.count(PayrollAnchorSummary.month), func.max(PayrollAnchorSummary.updated)) \
+        .filter_by(anchor_momo=momo_number).one()
+
+    def build():
+        payrolls = Payroll.query.join(Payroll.host).options(contains_eager(Payroll.host)) \
+            .filter(Payroll.anchor_momo == momo_number).order_by(desc(Payroll.date)).all()
+        return {'items': [serialize(p, fields) for p in payrolls]}
+
+    return conditional(build, stamp, anchor_stamp(entry))
+
+
+@api.route('/anchors/<momo_number>/payrolls/<month>')
+@admin_required
+def get_anchor_payroll(momo_number, month):
+    """
+    The payroll of an anchor in a month, with the penalties and comments of that month
+    """
+    fields = select_fields(PAYROLL_FIELDS, request.args.get('fields'))
+    entry = get_anchor(momo_number)
+    date = parse_month(month)
+
+    # payroll, penalty and comment changes all refresh the anchor's summary row
+    stamp = db.session.query(PayrollAnchorSummary.updated) \
+        .filter_by(anchor_momo=momo_number, month=date).scalar()
+
+    def build():
+        payroll = Payroll.query.filter_by(anchor_momo=momo_number, date=date).first()
+        if payroll is None:
+            raise ApiError(404, 'no payroll of {} in {:%Y-%m}'.format(momo_number, date))
+        body = serialize(payroll, fields)
+        body['penalties'] = [serialize(p, PENALTY_FIELDS.items()) for p in penalties_in_month(momo_number, date)]
+        body['comments'] = [serialize(c, COMMENT_FIELDS.items()) for c in comments_in_month(momo_number, date)]
+        return body
+
+    return conditional(build, stamp, anchor_stamp(entry))
+
+
+@api.route('/payrolls/<month>')
+@admin_required
+def list_month_payrolls(month):
+    """
+    The payrolls of a month, one cursor page at a time, with the totals of the whole month
+    """
+    fields = select_fields(PAYROLL_FIELDS, request.args.get('fields'))
+    sort, order = sort_args(PAYROLL_SORTS, 'momo_number')
+    q = request.args.get('q', '').strip()
+    date = parse_month(month)
+
+    # the month summary is refreshed with every change of the month's payrolls
+    stamp = db.session.query(PayrollMonthSummary.updated, PayrollMonthSummary.anchor_count) \
+        .filter_by(month=date).first()
+
+    def build():
+        summary = PayrollMonthSummary.query.get(date)
+        if summary is None:
+            raise ApiError(404, 'no payrolls in {:%Y-%m}'.format(date))
+
+        query = Payroll.query.join(Payroll.host).options(contains_eager(Payroll.host)).filter(Payroll.date == date)
+        if q:
+            query = query.filter(or_(Anchor.name.contains(q), Payroll.anchor_momo.startswith(q)))
+        page = keyset_paginate(query, PAYROLL_SORTS[sort], PAYROLL_KEYS[sort], sort, order,
+                               after=request.args.get('after'), limit=page_limit())
+
+        body = page_body(page, fields)
+        body['month'] = {'anchor_count': summary.anchor_count, 'ace_count': summary.ace_count,
+                         'coins': summary.coins, 'penalty': summary.penalty, 'salary': summary.salary}
+        return body
+
+    return conditional(build, stamp, anchors_stamp())
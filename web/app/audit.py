@@ -0,0 +1,242 @@
+# -*- coding: UTF-8 -*-
+import atexit
+import collections
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogWriter(object):
+    """
+    Collect audit log records in memory and write them to the logs table in bulk.
+
+    Records are flushed by a background thread when AUDIT_LOG_BATCH_SIZE records are
+    waiting, every AUDIT_LOG_FLUSH_INTERVAL seconds, and when the process exits.
+    If AUDIT_LOG_SPOOL_DIR is set every record is also appended to a spool file first;
+    spool files left behind by a process that died before flushing are replayed by
+    the next writer that starts.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._buffer = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+        self._spool = None
+        self._pending_spools = []
+        self._metrics = {
+            'flushed_total': 0,
+            'flush_count': 0,
+            'failed_flushes': 0,
+            'dropped_total': 0,
+            'replayed_total': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_LOG_BATCH_SIZE', 100)
+        app.config.setdefault('AUDIT_LOG_FLUSH_INTERVAL', 2.0)
+        app.config.setdefault('AUDIT_LOG_SPOOL_DIR', None)
+        app.config.setdefault('AUDIT_LOG_FSYNC', False)
+        self.app = app
+        atexit.register(self.close)
+
+    @property
+    def batch_size(self):
+        return self.app.config['AUDIT_LOG_BATCH_SIZE']
+
+    @property
+    def spool_dir(self):
+        return self.app.config['AUDIT_LOG_SPOOL_DIR']
+
+    def record(self, row):
+        """
+        Queue one logs row (a dict of column values)
+        """
+        self._ensure_started()
+        with self._lock:
+            if self._spool is not None:
+                self._spool[1].write(json.dumps(row) + '\n')
+                self._spool[1].flush()
+                if self.app.config['AUDIT_LOG_FSYNC']:
+                    os.fsync(self._spool[1].fileno())
+            self._buffer.append(row)
+            depth = len(self._buffer)
+        if depth >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Write every queued record with one multi-row INSERT.
+        On failure the records go back to the front of the queue.
+        """
+        with self._lock:
+            if not self._buffer:
+                return 0
+            batch = list(self._buffer)
+            self._buffer.clear()
+            if self._spool is not None:
+                # the records of this batch stay in the old spool file until they are written
+                self._pending_spools.append(self._spool)
+                self._spool = self._open_spool()
+
+        start = time.perf_counter()
+        try:
+            self._insert(batch)
+            written, dropped = batch, []
+        except Exception:
+            logger.exception('could not write %d audit log records', len(batch))
+            written, dropped = self._insert_each(batch)
+            if not written:
+                # most likely the database is unreachable, keep everything for the next flush
+                with self._lock:
+                    self._buffer.extendleft(reversed(batch))
+                    self._metrics['failed_flushes'] += 1
+                return 0
+
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            pending, self._pending_spools = self._pending_spools, []
+            m = self._metrics
+            m['flushed_total'] += len(written)
+            m['dropped_total'] += len(dropped)
+            m['flush_count'] += 1
+            m['last_flush_ms'] = elapsed
+            m['max_flush_ms'] = max(m['max_flush_ms'], elapsed)
+            m['total_flush_ms'] += elapsed
+        for path, f in pending:
+            # unlinked while still locked, a replaying writer cannot take the file over in between
+            os.remove(path)
+            f.close()
+        return len(written)
+
+    def replay_spool(self):
+        """
+        Write the records of spool files whose writer is gone, returns the number replayed.
+        A live writer holds a lock on its spool file, so only abandoned files can be locked here.
+        """
+        if not self.spool_dir:
+            return 0
+
+        replayed = 0
+        for path in glob.glob(os.path.join(self.spool_dir, 'audit-*.log')):
+            if self._spool is not None and path == self._spool[0]:
+                continue
+            try:
+                f = open(path, 'r+')
+            except (IOError, OSError):
+                continue
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                # opened just before its writer flushed and removed it
+                if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                    raise OSError('{} was removed'.format(path))
+            except (IOError, OSError):
+                f.close()
+                continue
+
+            try:
+                rows = [json.loads(line) for line in f if line.strip()]
+                if rows:
+                    self._insert(rows)
+                os.remove(path)
+                replayed += len(rows)
+            except Exception:
+                logger.exception('could not replay audit spool %s', path)
+            finally:
+                f.close()
+
+        with self._lock:
+            self._metrics['replayed_total'] += replayed
+        return replayed
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+            m['queue_depth'] = len(self._buffer)
+            m['pending_spool_files'] = len(self._pending_spools)
+        m['avg_flush_ms'] = m.pop('total_flush_ms') / m['flush_count'] if m['flush_count'] else 0.0
+        return m
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        if self.app is not None and self._pid == os.getpid():
+            self.flush()
+
+    def _insert(self, rows):
+        from . import db
+        from .models import Log
+
+        engine = db.get_engine(self.app)
+        with engine.begin() as connection:
+            connection.execute(Log.__table__.insert().values(rows))
+
+    def _insert_each(self, rows):
+        # write the records one by one so a single bad record cannot block the queue
+        written, dropped = [], []
+        for row in rows:
+            try:
+                self._insert([row])
+                written.append(row)
+            except Exception:
+                dropped.append(row)
+        if written and dropped:
+            logger.error('dropped %d audit log records: %s', len(dropped), dropped)
+        return written, dropped
+
+    def _open_spool(self):
+        # lock the file under a temporary name so a replaying process never sees it unlocked
+        name = 'audit-{}-{}.log'.format(os.getpid(), uuid.uuid4().hex)
+        path = os.path.join(self.spool_dir, name)
+        f = open(path + '.tmp', 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        os.rename(path + '.tmp', path)
+        return path, f
+
+    def _ensure_started(self):
+        # the flusher thread and spool file belong to one process, start new ones after a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # drop what was inherited from the parent, it flushes its own records
+            for _, f in self._pending_spools + ([self._spool] if self._spool else []):
+                f.close()
+            self._buffer.clear()
+            self._pending_spools = []
+            self._spool = None
+            if self.spool_dir:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                self._spool = self._open_spool()
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.replay_spool()
+        except Exception:
+            logger.exception('could not replay audit spool files')
+
+        while not self._stopped:
+            self._wakeup.wait(self.app.config['AUDIT_LOG_FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            self.flush()
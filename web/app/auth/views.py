@@ -1,12 +1,14 @@
-from flask import flash, redirect, render_template, url_for, session
+from flask import flash, redirect, render_template, url_for, session, make_response
 from flask_login import login_required, login_user, logout_user, current_user
 from flask_mail import Message
 
 from . import auth
 from .forms import LoginForm, RequestResetForm, ResetPasswordForm
-from .. import db, mail
+from ..throttle import LoginThrottled
+from .. import db, mail, login_guard, background
 from ..models import Employee
 from ..admin.helper import add_log
+from ..identity import invalidate_identities
 
 '''
 @auth.route('/register', methods=['GET', 'POST'])
@@ -59,12 +61,27 @@ def login():
     session.permanent = True
     form = LoginForm()
     if form.validate_on_submit():
+        try:
+            # attempts over the rate limit or beyond the hash pool are turned away before any hashing
+            login_guard.check_rate(form.email.data)
+
+            # check whether employee exists in the database and whether
+            # the password entered matches the password in the database
+            employee = Employee.query.filter_by(email=form.email.data).first()
+            verified = employee is not None and login_guard.verify(employee.password_hash, form.password.data)
+        except LoginThrottled as e:
+            flash('登录尝试过于频繁，请稍后再试。')
+            response = make_response(render_template('auth/login.html', form=form, title='Login'), 429)
+            if e.retry_after:
+                response.headers['Retry-After'] = str(e.retry_after)
+            return response
+
+        if verified:
+            # upgrade the hash when PASSWORD_HASH_METHOD has changed
+            if employee.needs_rehash():
+                employee.password = form.password.data
+                db.session.commit()
 
-        # check whether employee exists in the database and whether
-        # the password entered matches the password in the database
-        employee = Employee.query.filter_by(email=form.email.data).first()
-        if employee is not None and employee.verify_password(
-                form.password.data):
             # log employee in
             login_user(employee)
 
@@ -79,6 +96,7 @@ def login():
 
         # when login details are incorrect
         else:
+            login_guard.record_failure(form.email.data)
             add_log(form.email.data, "Login", status="F")
             flash('邮箱或密码错误。')
 
@@ -95,7 +113,8 @@ def send_reset_email(employee):
 
 如果不是您发出的请求，请忽略此邮件。
 '''
-    mail.send(msg)
+    # the SMTP round trips happen after the response, off the request worker
+    background.submit(mail.send, msg)
 
 @auth.route('/reset_password', methods=['GET', 'POST'])
 def reset_request():
@@ -119,6 +138,7 @@ def reset_password(token):
         password = form.password.data
         employee.password = password
         db.session.commit()
+        invalidate_identities()
         flash('你已成功重置密码，现在你可以登录。', 'success')
 
         add_log(employee.username, "Update password", 
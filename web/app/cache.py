@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+
+
+def _version_path(name):
+    return os.path.join(current_app.config['CACHE_VERSION_DIR'], name)
+
+
+def get_version(name):
+    """
+    Return the current version token of a cached data set, None if it was never bumped.
+    Tokens live in small files so that every uWSGI/worker process on the host sees a bump
+    without a database round-trip.
+    """
+    try:
+        with open(_version_path(name)) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def bump_version(name):
+    """
+    Invalidate every process-local cache built from the named data set.
+    Call it after the change has been committed.
+    """
+    path = _version_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    token = uuid.uuid4().hex
+    tmp = '{}.{}'.format(path, token)
+    with open(tmp, 'w') as f:
+        f.write(token)
+    os.replace(tmp, path)
+
+
+class VersionedCache(object):
+    """
+    Process-local cache whose entries are dropped as soon as the version of the
+    data set they were built from changes. maxsize bounds the number of entries,
+    least recently used first out, and ttl (seconds) the age of an entry.
+    """
+    def __init__(self, name, maxsize=None, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, version=None):
+        # callers looking up many keys at once may read the version themselves
+        if version is None:
+            version = get_version(self.name)
+        with self._lock:
+            if version != self._version:
+                self._data.clear()
+                self._version = version
+            if key in self._data:
+                expires, value = self._data[key]
+                if expires is None or expires > time.time():
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+
+        value = loader()
+
+        with self._lock:
+            # don't store a value built while the data set was being changed
+            if self._version == version:
+                self._data[key] = (time.time() + self.ttl if self.ttl else None, value)
+                if self.maxsize and len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that reports how long every checkout waited for a connection
+    """
+    monitor = None
+
+    def _do_get(self):
+        # every pooled and overflow connection is taken, the checkout has to wait for a checkin
+        waited = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        start = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self.monitor.record_checkout(time.perf_counter() - start, waited, timed_out=True)
+            raise
+        self.monitor.record_checkout(time.perf_counter() - start, waited)
+        return connection
+
+
+class PoolMonitor(object):
+    """
+    Configure the connection pool of the SQLAlchemy engine and collect its metrics.
+
+    The pool is built from the DB_POOL_* settings of the config class. Connections
+    are tagged with the pid of the process that opened them and a connection
+    inherited through a fork (uWSGI without lazy-apps, the import worker
+    processes) is discarded on checkout instead of being shared with the parent.
+    DB_POOL_PRE_PING is done by the checkout listener after that check, not by
+    the pool's pool_pre_ping, which would ping first on the parent's socket.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DB_POOL_SIZE', 5)
+        app.config.setdefault('DB_MAX_OVERFLOW', 10)
+        app.config.setdefault('DB_POOL_TIMEOUT', 30)
+        app.config.setdefault('DB_POOL_RECYCLE', 1800)
+        app.config.setdefault('DB_POOL_PRE_PING', True)
+        # milliseconds, None leaves the server default
+        app.config.setdefault('DB_STATEMENT_TIMEOUT', None)
+        self.app = app
+
+        poolclass = type('InstrumentedQueuePool', (InstrumentedQueuePool,), {'monitor': self})
+        event.listen(poolclass, 'connect', self._on_connect)
+        event.listen(poolclass, 'checkout', self._on_checkout)
+
+        options = dict(poolclass=poolclass,
+                       pool_size=app.config['DB_POOL_SIZE'],
+                       max_overflow=app.config['DB_MAX_OVERFLOW'],
+                       pool_timeout=app.config['DB_POOL_TIMEOUT'],
+                       pool_recycle=app.config['DB_POOL_RECYCLE'],
+                       pool_pre_ping=False)
+        if app.config['DB_STATEMENT_TIMEOUT']:
+            options['connect_args'] = {
+                'options': '-c statement_timeout={:d}'.format(app.config['DB_STATEMENT_TIMEOUT'])}
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    def record_checkout(self, seconds, waited, timed_out=False):
+        elapsed = seconds * 1000
+        with self._lock:
+            m = self._process_metrics()
+            m['checkouts'] += 1
+            m['waits'] += int(waited)
+            m['timeouts'] += int(timed_out)
+            m['last_checkout_ms'] = elapsed
+            m['max_checkout_ms'] = max(m['max_checkout_ms'], elapsed)
+            m['total_checkout_ms'] += elapsed
+
+    def stats(self):
+        from . import db
+
+        pool = db.get_engine(self.app).pool
+        with self._lock:
+            m = dict(self._process_metrics())
+        m['avg_checkout_ms'] = m.pop('total_checkout_ms') / m['checkouts'] if m['checkouts'] else 0.0
+        m['pool_size'] = pool.size()
+        m['in_use'] = pool.checkedout()
+        m['idle'] = pool.checkedin()
+        m['overflow'] = max(pool.overflow(), 0)
+        return m
+
+    def _process_metrics(self):
+        # counters are per process, a forked child starts from zero
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._metrics = {
+                'checkouts': 0,
+                'waits': 0,
+                'timeouts': 0,
+                'connects': 0,
+                'forked_discards': 0,
+                'last_checkout_ms': 0.0,
+                'max_checkout_ms': 0.0,
+                'total_checkout_ms': 0.0,
+            }
+        return self._metrics
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+        # just opened, the first checkout has no need to ping it
+        connection_record.info['fresh'] = True
+        with self._lock:
+            self._process_metrics()['connects'] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get('pid') != os.getpid():
+            with self._lock:
+                self._process_metrics()['forked_discards'] += 1
+            # drop the parent's socket without closing it, the pool then opens a new connection
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                'connection record belongs to pid {}, checked out in pid {}'.format(
+                    connection_record.info.get('pid'), os.getpid()))
+
+        if self.app.config['DB_POOL_PRE_PING'] and not connection_record.info.pop('fresh', False):
+            try:
+                cursor = dbapi_connection.cursor()
+                cursor.execute('select 1')
+                cursor.close()
+            except Exception as e:
+                # the pool replaces the connection and checks out again
+                raise exc.DisconnectionError('connection failed the checkout ping: {}'.format(e))
+
+
+def disable_statement_timeout(connection):
+    """
+    Lift DB_STATEMENT_TIMEOUT for the current transaction of a long running batch job
+    """
+    connection.execute('set local statement_timeout = 0')
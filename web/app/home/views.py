@@ -4,12 +4,17 @@ import datetime
 from flask import render_template, abort, flash, redirect, url_for, request
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
+from sqlalchemy import exc
 
 from . import home
-from ..admin.forms import AnchorForm, PenaltyForm
-from ..models import Anchor, Penalty
+from ..admin.forms import AnchorForm, PenaltyForm, BulkPenaltyForm
+from ..models import Anchor, Penalty, PayrollMonthSummary
 from .. import db
 from ..admin.helper import add_log
+from ..admin.anchor_index import find_anchor, invalidate_anchor_index
+from ..admin.summary import refresh_summaries
+from ..admin.bulk import submitted_rows, parse_amount, insert_rows, id_range
+from ..admin.recalc import mark_dirty
 
 
 @home.route('/')
@@ -36,7 +41,10 @@ def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
 
-    return render_template('home/admin_dashboard.html', title="Dashboard")
+    # month overviews come from the summary table, one row per month
+    summaries = PayrollMonthSummary.query.order_by(PayrollMonthSummary.month.desc()).limit(12).all()
+
+    return render_template('home/admin_dashboard.html', summaries=summaries, title="Dashboard")
 
 @home.route('/dashboard/add_anchor', methods=['GET', 'POST'])
 @login_required
@@ -70,6 +78,7 @@ def add_anchor():
         try:
             db.session.add(anchor)
             db.session.commit()
+            invalidate_anchor_index()
 
             upload_folder = os.getenv('UPLOAD_FOLDER')
             directory = upload_folder + "/" + form.momo_number.data
@@ -102,6 +111,12 @@ def add_penalty():
     form = PenaltyForm()
 
     if form.validate_on_submit():
+        if not find_anchor(form.momo_number.data.strip()):
+            flash(u'错误:此陌陌号不存在, 请验证输入的陌陌号重试')
+            add_log(current_user.username,
+                    "Add", target_table="penalties", status="F")
+            return redirect(url_for('home.dashboard'))
+
         penalty = Penalty(
             anchor_momo=form.momo_number.data.strip(),
             date=datetime.date.today().strftime("%Y-%m-%d"),
@@ -109,6 +124,9 @@ def add_penalty():
         )
         try:
             db.session.add(penalty)
+            db.session.flush()
+            refresh_summaries(db.session.connection(), datetime.datetime.today(), [penalty.anchor_momo])
+            mark_dirty(db.session.connection(), [penalty.anchor_momo], datetime.datetime.today())
             db.session.commit()
 
             flash(u'此罚款记录已成功录入')
@@ -127,3 +145,37 @@ def add_penalty():
 
     return render_template('home/add_penalty.html', form=form,
                             title="Add Penalty")
+
+
+@home.route('/dashboard/penalty_form/bulk', methods=['GET', 'POST'])
+@login_required
+def add_penalties():
+    """
+    Add many penalties at once, from a pasted table or a CSV file
+    """
+    form = BulkPenaltyForm()
+    report = None
+
+    if form.validate_on_submit():
+        rows = submitted_rows(form, parse_amount)
+        if not rows:
+            flash(u'错误:没有可录入的罚款记录')
+            return render_template('home/add_penalties.html', form=form,
+                                   report=report, title="Add Penalties")
+
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        try:
+            report, ids = insert_rows(db.session.connection(), Penalty.__table__, 'amount', rows, today)
+            mark_dirty(db.session.connection(), {r.momo_number for r in report if r.error is None}, today)
+            db.session.commit()
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            flash(u'错误:罚款记录录入失败, 请重试')
+            add_log(current_user.username, "Bulk Add", target_table="penalties", status="F")
+        else:
+            flash(u'已录入{}条罚款记录, {}条有误未录入'.format(len(ids), len(report) - len(ids)))
+            add_log(current_user.username, "Bulk Add", target_id=id_range(ids),
+                    target_table="penalties", status="S" if ids else "F")
+
+    return render_template('home/add_penalties.html', form=form,
+                           report=report, title="Add Penalties")
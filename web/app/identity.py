@@ -0,0 +1,55 @@
+# -*- coding: UTF-8 -*-
+from flask import current_app
+from flask_login import UserMixin
+
+from .cache import VersionedCache, bump_version
+
+_identities = None
+
+
+class EmployeeIdentity(UserMixin):
+    """
+    Detached snapshot of an employee, all a request needs to authorise its user
+    """
+    def __init__(self, id, email, username, is_admin, department_id=None, department=None,
+                 role_id=None, role=None):
+        self.id = id
+        self.email = email
+        self.username = username
+        self.is_admin = bool(is_admin)
+        self.department_id = department_id
+        self.department = department
+        self.role_id = role_id
+        self.role = role
+
+    def __repr__(self):
+        return '<EmployeeIdentity: {}>'.format(self.username)
+
+
+def load_identity(employee_id):
+    """
+    Return the identity of an employee from the process cache, None if there is no such employee
+    """
+    global _identities
+    if _identities is None:
+        _identities = VersionedCache('employees', maxsize=current_app.config['IDENTITY_CACHE_SIZE'],
+                                     ttl=current_app.config['IDENTITY_CACHE_TTL'])
+    return _identities.get(employee_id, lambda: _snapshot(employee_id))
+
+
+def invalidate_identities():
+    """
+    Drop the cached identities in every process, call after an employee, department or role was committed
+    """
+    bump_version('employees')
+
+
+def _snapshot(employee_id):
+    from .models import Employee
+
+    employee = Employee.query.get(employee_id)
+    if employee is None:
+        return None
+    return EmployeeIdentity(employee.id, employee.email, employee.username, employee.is_admin,
+                            employee.department_id, employee.department.name if employee.department else None,
+                            employee.role_id, employee.role.name if employee.role else None)
@@ -1,9 +1,12 @@
+import datetime
+
 from flask import current_app
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
 from app import db, login_manager
+from app.identity import load_identity
 import app
 
 class Employee(UserMixin, db.Model):
@@ -35,7 +38,7 @@ class Employee(UserMixin, db.Model):
         """
         Set password to a hashed password
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
 
     def verify_password(self, password):
         """
@@ -43,6 +46,12 @@ class Employee(UserMixin, db.Model):
         """
         return check_password_hash(self.password_hash, password)
 
+    def needs_rehash(self):
+        """
+        Check if the password was hashed with another method or cost than PASSWORD_HASH_METHOD
+        """
+        return self.password_hash.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']
+
     def get_reset_token(self, expires_sec=1800):
         s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
         return s.dumps({'user_id': self.id}).decode('utf-8')
@@ -60,10 +69,10 @@ class Employee(UserMixin, db.Model):
         return '<Employee: {}>'.format(self.username)
 
 
-# Set up user_loader
+# Set up user_loader, authenticated requests get a cached snapshot instead of a query
 @login_manager.user_loader
 def load_user(user_id):
-    return Employee.query.get(int(user_id))
+    return load_identity(int(user_id))
 
 class Department(db.Model):
     """
@@ -119,6 +128,8 @@ class Anchor(db.Model):
     percentage = db.Column(db.Float, default=0.0)
     ace_anchor_or_not = db.Column(db.Boolean, default=False, nullable=True)
     agent = db.Column(db.String(60), nullable=True)
+    # last insert or edit through the ORM, part of the API ETags
+    updated = db.Column(db.DateTime, nullable=True, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     payrolls = db.relationship('Payroll', backref='host', lazy='dynamic')
     penalties = db.relationship('Penalty', backref='host', lazy='dynamic')
     comments = db.relationship('Comment', backref='host', lazy='dynamic')
@@ -131,6 +142,11 @@ class Payroll(db.Model):
     Create a payroll table
     """
     __tablename__ = "payrolls"
+    __table_args__ = (
+        # one anchor's month or history, and a whole month listed by anchor
+        db.Index('ix_payrolls_anchor_momo_date', 'anchor_momo', 'date'),
+        db.Index('ix_payrolls_date_anchor_momo', 'date', 'anchor_momo'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=True)
@@ -151,6 +167,11 @@ class Penalty(db.Model):
     Create a penalty table
     """
     __tablename__ = "penalties"
+    __table_args__ = (
+        # one anchor's penalties of a month, and every penalty of a month for the salary pass
+        db.Index('ix_penalties_anchor_momo_date', 'anchor_momo', 'date'),
+        db.Index('ix_penalties_date', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=True)
@@ -165,6 +186,11 @@ class Comment(db.Model):
     Create a comment table 
     """
     __tablename__ = "comments"
+    __table_args__ = (
+        # one anchor's comments of a month, and the comment listing sorted by date
+        db.Index('ix_comments_anchor_momo_date', 'anchor_momo', 'date'),
+        db.Index('ix_comments_date_id', 'date', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=True)
@@ -192,3 +218,122 @@ class Log(db.Model):
     def __repr__(self):
         return 'Log: {} {} {} of {}'.format(self.user, self.action, self.target_id, self.target_table)
 
+
+
+class ImportJob(db.Model):
+    """
+    Create an import job table, one row per uploaded monthly report waiting for
+    or processed by the background import worker
+    """
+    __tablename__ = "import_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(db.DateTime, nullable=False)
+    started = db.Column(db.DateTime, nullable=True)
+    finished = db.Column(db.DateTime, nullable=True)
+    user = db.Column(db.String(60), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(10), index=True, nullable=False, default='queued')
+    stage = db.Column(db.String(20), nullable=True)
+    progress = db.Column(db.Integer, default=0)
+    total_rows = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.Text, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'total_rows': self.total_rows,
+            'message': self.message,
+        }
+
+    def __repr__(self):
+        return 'ImportJob: {} {} ({})'.format(self.id, self.filename, self.status)
+
+
+class ImportManifest(db.Model):
+    """
+    Create an import manifest table, one row per distinct uploaded file keyed by
+    the sha256 of its content, with the outcome of its latest import
+    """
+    __tablename__ = "import_manifests"
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    month = db.Column(db.DateTime, index=True, nullable=True)
+    row_count = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(10), nullable=False, default='stored')
+    message = db.Column(db.Text, nullable=True)
+    job_id = db.Column(db.Integer, nullable=True)
+    created = db.Column(db.DateTime, nullable=False)
+    updated = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return 'ImportManifest: {} {} ({})'.format(self.sha256[:12], self.filename, self.status)
+
+
+class PayrollMonthSummary(db.Model):
+    """
+    Create a table of monthly payroll totals, refreshed whenever the month changes
+    """
+    __tablename__ = "payroll_month_summaries"
+
+    month = db.Column(db.DateTime, primary_key=True)
+    anchor_count = db.Column(db.Integer, default=0)
+    ace_count = db.Column(db.Integer, default=0)
+    coins = db.Column(db.Float, default=0.0)
+    guild_division = db.Column(db.Float, default=0.0)
+    profit = db.Column(db.Float, default=0.0)
+    penalty = db.Column(db.Float, default=0.0)
+    salary = db.Column(db.Float, default=0.0)
+    ace_salary = db.Column(db.Float, default=0.0)
+    non_ace_salary = db.Column(db.Float, default=0.0)
+    updated = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return 'PayrollMonthSummary: {}: {}'.format(self.month, self.salary)
+
+
+class PayrollAnchorSummary(db.Model):
+    """
+    Create a table of payroll totals per anchor and month
+    """
+    __tablename__ = "payroll_anchor_summaries"
+    __table_args__ = (
+        db.Index('ix_payroll_anchor_summaries_month_salary', 'month', 'salary'),
+    )
+
+    anchor_momo = db.Column(db.String(60), primary_key=True)
+    month = db.Column(db.DateTime, primary_key=True)
+    coins = db.Column(db.Float, default=0.0)
+    guild_division = db.Column(db.Float, default=0.0)
+    profit = db.Column(db.Float, default=0.0)
+    penalty = db.Column(db.Float, default=0.0)
+    salary = db.Column(db.Float, default=0.0)
+    penalty_count = db.Column(db.Integer, default=0)
+    comment_count = db.Column(db.Integer, default=0)
+    updated = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return 'PayrollAnchorSummary: {}: {}: {}'.format(self.anchor_momo, self.month, self.salary)
+
+
+class SalaryDirty(db.Model):
+    """
+    Create a table of the (anchor, month) payrolls whose salary must be computed
+    again after a penalty or a change of the anchor's terms
+    """
+    __tablename__ = "salary_dirty"
+
+    anchor_momo = db.Column(db.String(60), primary_key=True)
+    month = db.Column(db.DateTime, primary_key=True)
+    marked = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return 'SalaryDirty: {}: {}'.format(self.anchor_momo, self.month)
@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTasks(object):
+    """
+    Thread pool running the blocking I/O of a request, such as sending mail, after
+    the response went out, so a slow remote server does not hold a worker.
+    Tasks run inside an application context. When OFFLOAD_QUEUE tasks are already
+    waiting the task runs in the request instead, the pool never grows unbounded.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+        self._metrics = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # threads per worker process, and tasks allowed to wait for one of them
+        app.config.setdefault('OFFLOAD_WORKERS', 4)
+        app.config.setdefault('OFFLOAD_QUEUE', 100)
+        # run tasks in the request, tests and scripts see their effect right away
+        app.config.setdefault('OFFLOAD_SYNC', False)
+        self.app = app
+        self._pid = None
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the pool, returns its future or None when it ran in the request
+        """
+        self._count('submitted')
+        executor, slots = self._pool()
+        if self.app.config['OFFLOAD_SYNC'] or not slots.acquire(blocking=False):
+            self._count('ran_inline')
+            self._run(fn, args, kwargs)
+            return None
+
+        future = executor.submit(self._run, fn, args, kwargs)
+        future.add_done_callback(lambda f: slots.release())
+        return future
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics) if self._pid == os.getpid() else {}
+        for name in ('submitted', 'completed', 'failed', 'ran_inline', 'task_ms'):
+            m.setdefault(name, 0)
+        m['pending'] = m['submitted'] - m['completed'] - m['failed']
+        done = m['completed'] + m['failed']
+        m['avg_task_ms'] = m.pop('task_ms') / done if done else 0.0
+        return m
+
+    def _run(self, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            with self.app.app_context():
+                fn(*args, **kwargs)
+        except Exception:
+            self._count('failed')
+            logger.exception('background task %s failed', getattr(fn, '__name__', fn))
+        else:
+            self._count('completed')
+        self._count('task_ms', (time.perf_counter() - start) * 1000)
+
+    def _pool(self):
+        # the threads of a parent process do not survive a fork, start a new pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.app.config['OFFLOAD_WORKERS'],
+                                                        thread_name_prefix='offload')
+                    self._slots = threading.BoundedSemaphore(self.app.config['OFFLOAD_QUEUE'])
+                    self._metrics = {}
+                    self._pid = os.getpid()
+        return self._executor, self._slots
+
+    def _count(self, name, value=1):
+        self._pool()
+        with self._lock:
+            self._metrics[name] = self._metrics.get(name, 0) + value
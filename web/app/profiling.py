@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+import bisect
+import heapq
+import threading
+import time
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds (ms) of the request time histogram buckets, the last bucket is open
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class RequestProfiler(object):
+    """
+    Record the wall time, SQL statements and template render time of every request.
+
+    Off unless PROFILE_REQUESTS is set. The figures are aggregated per endpoint in
+    the process serving the requests, together with the PROFILE_SLOWEST_STATEMENTS
+    slowest SQL statements seen so far.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._slowest = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_REQUESTS', False)
+        app.config.setdefault('PROFILE_SLOWEST_STATEMENTS', 20)
+        self.app = app
+        if not app.config['PROFILE_REQUESTS']:
+            return
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+        event.listen(Engine, 'before_cursor_execute', self._start_statement)
+        event.listen(Engine, 'after_cursor_execute', self._finish_statement)
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config['PROFILE_REQUESTS']
+
+    def stats(self):
+        """
+        Return the per endpoint figures, busiest first, and the slowest statements
+        """
+        with self._lock:
+            endpoints = [dict(e, histogram=list(e['histogram'])) for e in self._endpoints.values()]
+            slowest = sorted(self._slowest, reverse=True)
+
+        for e in endpoints:
+            n = e['requests']
+            e['avg_ms'] = e.pop('total_ms') / n
+            e['avg_queries'] = e.pop('total_queries') / n
+            e['avg_sql_ms'] = e.pop('total_sql_ms') / n
+            e['avg_template_ms'] = e.pop('total_template_ms') / n
+        endpoints.sort(key=lambda e: e['requests'], reverse=True)
+
+        return dict(buckets_ms=list(BUCKETS_MS) + [None],
+                    endpoints=endpoints,
+                    slowest_statements=[dict(ms=ms, endpoint=endpoint, statement=statement)
+                                        for ms, endpoint, statement in slowest])
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._slowest = []
+
+    def _start_request(self):
+        g.profile = dict(start=time.perf_counter(), queries=0, sql_ms=0.0, template_ms=0.0,
+                         statements=[], renders=[])
+
+    def _finish_request(self, exception=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        elapsed = (time.perf_counter() - profile['start']) * 1000
+        endpoint = request.endpoint or '<unmatched>'
+
+        with self._lock:
+            e = self._endpoints.get(endpoint)
+            if e is None:
+                e = self._endpoints[endpoint] = dict(
+                    endpoint=endpoint, requests=0, errors=0, histogram=[0] * (len(BUCKETS_MS) + 1),
+                    total_ms=0.0, max_ms=0.0, total_queries=0, max_queries=0,
+                    total_sql_ms=0.0, total_template_ms=0.0)
+            e['requests'] += 1
+            e['errors'] += int(exception is not None)
+            e['histogram'][bisect.bisect_left(BUCKETS_MS, elapsed)] += 1
+            e['total_ms'] += elapsed
+            e['max_ms'] = max(e['max_ms'], elapsed)
+            e['total_queries'] += profile['queries']
+            e['max_queries'] = max(e['max_queries'], profile['queries'])
+            e['total_sql_ms'] += profile['sql_ms']
+            e['total_template_ms'] += profile['template_ms']
+
+            limit = self.app.config['PROFILE_SLOWEST_STATEMENTS']
+            for ms, statement in heapq.nlargest(limit, profile['statements']):
+                item = (ms, endpoint, statement)
+                if len(self._slowest) < limit:
+                    heapq.heappush(self._slowest, item)
+                elif self._slowest and item > self._slowest[0]:
+                    heapq.heapreplace(self._slowest, item)
+
+    def _start_render(self, sender, template, context, **extra):
+        profile = g.get('profile')
+        if profile is not None:
+            profile['renders'].append(time.perf_counter())
+
+    def _finish_render(self, sender, template, context, **extra):
+        profile = g.get('profile')
+        if profile is not None and profile['renders']:
+            profile['template_ms'] += (time.perf_counter() - profile['renders'].pop()) * 1000
+
+    def _start_statement(self, conn, cursor, statement, parameters, context, executemany):
+        # statements run outside of a request (audit log writer, import worker) are not profiled
+        if has_request_context() and 'profile' in g:
+            conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+    def _finish_statement(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profile_start')
+        if not starts or not has_request_context() or 'profile' not in g:
+            return
+        ms = (time.perf_counter() - starts.pop()) * 1000
+        profile = g.profile
+        profile['queries'] += 1
+        profile['sql_ms'] += ms
+        profile['statements'].append((ms, ' '.join(statement.split())[:500]))
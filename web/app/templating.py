@@ -0,0 +1,100 @@
+# -*- coding: UTF-8 -*-
+import os
+import tempfile
+import threading
+
+from flask import _app_ctx_stack
+from jinja2 import FileSystemBytecodeCache
+
+from .cache import VersionedCache, get_version
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """
+    Compiled templates on disk, shared by every worker process on the host.
+    Files are written under a temporary name and renamed, so a worker never
+    loads the half written bytecode of another one.
+    """
+    def dump_bytecode(self, bucket):
+        path = self._get_cache_filename(bucket)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, path)
+        except OSError:
+            # the cache is an optimisation, the template is compiled again next time
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+class FragmentCache(object):
+    """
+    Rendered template fragments, e.g. the rows of the large admin tables, kept
+    by each process until the data set they show changes:
+
+        {% call cached_fragment('anchors', anchor.id) %} <tr>...</tr> {% endcall %}
+
+    A fragment is cached under its name and key, and is rendered again after a
+    bump of the data set called name or of any of the `depends` data sets.
+    Also installs the on-disk template bytecode cache.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_ENABLED', True)
+        # fragments kept per name by each process
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 5000)
+        # compiled templates shared by the worker processes, None to compile in every process
+        app.config.setdefault('JINJA_BYTECODE_DIR', os.path.join(tempfile.gettempdir(), 'flask_app_jinja'))
+        self.app = app
+
+        if app.config['JINJA_BYTECODE_DIR']:
+            os.makedirs(app.config['JINJA_BYTECODE_DIR'], exist_ok=True)
+            app.jinja_env.bytecode_cache = SharedBytecodeCache(app.config['JINJA_BYTECODE_DIR'])
+        app.jinja_env.globals['cached_fragment'] = self.fragment
+
+    def fragment(self, name, key, depends=(), caller=None):
+        if not self.app.config['FRAGMENT_CACHE_ENABLED']:
+            return caller()
+
+        versions = self._versions((name,) + tuple(depends))
+        state = {'missed': False}
+
+        def render():
+            state['missed'] = True
+            return caller()
+
+        value = self._cache(name).get((key,) + versions[1:], render, version=versions[0])
+        with self._lock:
+            self._metrics['misses' if state['missed'] else 'hits'] += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+            m['fragments'] = sum(len(c._data) for c in self._caches.values())
+        return m
+
+    def _cache(self, name):
+        cache = self._caches.get(name)
+        if cache is None:
+            with self._lock:
+                cache = self._caches.setdefault(
+                    name, VersionedCache(name, maxsize=self.app.config['FRAGMENT_CACHE_SIZE']))
+        return cache
+
+    def _versions(self, names):
+        # read once per request, a table of rows would otherwise read every version file per row;
+        # g of the request's context, without going through its proxy for every row
+        seen = _app_ctx_stack.top.g.__dict__.setdefault('_fragment_versions', {})
+        for name in names:
+            if name not in seen:
+                seen[name] = get_version(name)
+        return tuple(seen[name] for name in names)
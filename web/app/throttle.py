@@ -0,0 +1,187 @@
+# -*- coding: UTF-8 -*-
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import request
+from werkzeug.security import check_password_hash
+
+
+class LoginThrottled(Exception):
+    """
+    Raised when a login attempt is rejected before its password is checked
+    """
+    def __init__(self, reason, retry_after=None):
+        super(LoginThrottled, self).__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBuckets(object):
+    """
+    Token buckets kept in a sqlite file, so every worker process on the host shares them
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def take(self, key, capacity, per_seconds, consume=True):
+        """
+        Take one token from the bucket of key, refilled at capacity tokens per per_seconds.
+        Returns 0 if a token was available, otherwise the seconds until the next one.
+        With consume=False the bucket is only checked.
+        """
+        rate = float(capacity) / per_seconds
+        connection = self._connection()
+        # immediate: the read-modify-write of a bucket must not interleave between processes
+        connection.execute('begin immediate')
+        try:
+            now = time.time()
+            row = connection.execute('select tokens, updated from buckets where key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+            if tokens >= 1:
+                tokens -= int(consume)
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            connection.execute('insert or replace into buckets (key, tokens, updated) values (?, ?, ?)',
+                               (key, tokens, now))
+            connection.execute('commit')
+        except Exception:
+            connection.execute('rollback')
+            raise
+        return wait
+
+    def purge(self, older_than):
+        """
+        Drop the buckets untouched for older_than seconds, they are full again anyway
+        """
+        self._connection().execute('delete from buckets where updated < ?', (time.time() - older_than,))
+
+    def _connection(self):
+        # sqlite connections must not cross threads or a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('pragma journal_mode=wal')
+            connection.execute('create table if not exists buckets '
+                               '(key text primary key, tokens real not null, updated real not null)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+class LoginGuard(object):
+    """
+    Rate limit login attempts and check passwords on a bounded thread pool.
+
+    Every attempt takes a token from the bucket of its client IP before any password
+    hash is computed, and is refused while the bucket of the email it targets is empty;
+    only failed attempts take from the email bucket, so a locked out account does not
+    stop its owner from logging in afterwards. Hashes are checked by at most
+    LOGIN_HASH_WORKERS threads per process; when LOGIN_HASH_QUEUE checks are already
+    pending the attempt is rejected at once instead of queuing behind an attack.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+        self._buckets = None
+        self._metrics = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # attempts allowed per window (seconds) for a single client IP and a single email
+        app.config.setdefault('LOGIN_IP_RATE', (10, 60))
+        app.config.setdefault('LOGIN_EMAIL_RATE', (5, 300))
+        # request header holding the client address when running behind a proxy
+        app.config.setdefault('LOGIN_CLIENT_IP_HEADER', None)
+        app.config.setdefault('LOGIN_THROTTLE_DB', os.path.join(tempfile.gettempdir(), 'login_throttle.sqlite'))
+        app.config.setdefault('LOGIN_HASH_WORKERS', 2)
+        app.config.setdefault('LOGIN_HASH_QUEUE', 4)
+        app.config.setdefault('LOGIN_HASH_TIMEOUT', 5)
+        self.app = app
+        self._buckets = TokenBuckets(app.config['LOGIN_THROTTLE_DB'])
+
+    def client_ip(self):
+        header = self.app.config['LOGIN_CLIENT_IP_HEADER']
+        if header and request.headers.get(header):
+            return request.headers[header].split(',')[0].strip()
+        return request.remote_addr or 'unknown'
+
+    def check_rate(self, email):
+        """
+        Take a token for the client IP and check the one of the email, raise LoginThrottled if either is out
+        """
+        if self._count('attempts') % 1000 == 0:
+            self.purge()
+        for kind, key, consume in (('ip', self.client_ip(), True), ('email', (email or '').lower(), False)):
+            capacity, per_seconds = self.app.config['LOGIN_{}_RATE'.format(kind.upper())]
+            wait = self._buckets.take(kind + ':' + key, capacity, per_seconds, consume=consume)
+            if wait:
+                self._count(kind + '_throttled')
+                raise LoginThrottled(kind, retry_after=int(wait) + 1)
+
+    def record_failure(self, email):
+        """
+        Take a token from the bucket of an email after a wrong password
+        """
+        capacity, per_seconds = self.app.config['LOGIN_EMAIL_RATE']
+        self._buckets.take('email:' + (email or '').lower(), capacity, per_seconds)
+
+    def verify(self, password_hash, password):
+        """
+        Check a password against its hash on the hash pool, raise LoginThrottled if it is saturated
+        """
+        executor, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            self._count('busy_rejected')
+            raise LoginThrottled('busy')
+
+        start = time.perf_counter()
+        future = executor.submit(check_password_hash, password_hash, password)
+        future.add_done_callback(lambda f: slots.release())
+        try:
+            result = future.result(timeout=self.app.config['LOGIN_HASH_TIMEOUT'])
+        except TimeoutError:
+            self._count('busy_rejected')
+            raise LoginThrottled('busy')
+        self._count('verified')
+        self._count('verify_ms', (time.perf_counter() - start) * 1000)
+        return result
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics) if self._pid == os.getpid() else {}
+        for name in ('attempts', 'verified', 'verify_ms', 'ip_throttled', 'email_throttled', 'busy_rejected'):
+            m.setdefault(name, 0)
+        m['avg_verify_ms'] = m.pop('verify_ms') / m['verified'] if m['verified'] else 0.0
+        return m
+
+    def purge(self):
+        longest = max(self.app.config['LOGIN_IP_RATE'][1], self.app.config['LOGIN_EMAIL_RATE'][1])
+        self._buckets.purge(longest)
+
+    def _pool(self):
+        # the threads of a parent process do not survive a fork, start a new pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.app.config['LOGIN_HASH_WORKERS'])
+                    self._slots = threading.BoundedSemaphore(self.app.config['LOGIN_HASH_QUEUE'])
+                    self._metrics = {}
+                    self._pid = os.getpid()
+        return self._executor, self._slots
+
+    def _count(self, name, value=1):
+        self._pool()
+        with self._lock:
+            self._metrics[name] = self._metrics.get(name, 0) + value
+            return self._metrics[name]
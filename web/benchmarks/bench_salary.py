@@ -0,0 +1,112 @@
+# -*- coding: UTF-8 -*-
+"""
+Compare the per-row salary loop that used to run in admin.views.upload with the
+aggregated update in app.admin.salary.
+
+All rows are seeded inside a transaction that is rolled back at the end, so the
+benchmark can be pointed at any configured database:
+
+    FLASK_CONFIG=development python -m benchmarks.bench_salary --anchors 5000
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+from sqlalchemy import text
+
+from app import create_app, db
+from app.models import Anchor, Payroll, Penalty
+from app.admin.salary import update_salaries, calculate_salary
+
+
+def seed(connection, month, anchors, penalties, history):
+    prefix = 'bench{}'.format(random.randint(10000, 99999))
+    momo_numbers = ['{}{:06d}'.format(prefix, i) for i in range(anchors)]
+
+    connection.execute(Anchor.__table__.insert(), [
+        {'name': n, 'momo_number': n, 'percentage': random.choice([0.3, 0.4, 0.5]),
+         'ace_anchor_or_not': random.random() < 0.2}
+        for n in momo_numbers])
+
+    # spread the penalty history over the previous months as well, the old loop
+    # walked all of it for every payroll row
+    rows = []
+    for n in momo_numbers:
+        for _ in range(penalties):
+            offset = random.randint(0, history)
+            day = month - datetime.timedelta(days=30 * offset) + datetime.timedelta(days=random.randint(0, 27))
+            rows.append({'anchor_momo': n, 'date': day, 'amount': random.randint(1, 20) * 10})
+    if rows:
+        connection.execute(Penalty.__table__.insert(), rows)
+
+    connection.execute(Payroll.__table__.insert(), [
+        {'anchor_momo': n, 'date': month, 'coins': float(random.randint(0, 500000))}
+        for n in momo_numbers])
+    return momo_numbers
+
+
+def legacy_loop(session, date_object):
+    for payroll in session.query(Payroll).filter_by(date=date_object).all():
+        penalties = payroll.host.penalties
+        penalty_sum = 0
+        for p in penalties:
+            if p.date.year == date_object.year and p.date.month == date_object.month:
+                penalty_sum += p.amount
+
+        payroll.penalty = penalty_sum
+        payroll.salary = calculate_salary(payroll.coins, payroll.host.percentage,
+                                          payroll.host.ace_anchor_or_not, penalty_sum)
+    session.flush()
+
+
+def snapshot(connection, month):
+    rows = connection.execute(text("select anchor_momo, penalty, salary from payrolls where date = :month"),
+                              month=month)
+    return {r[0]: (r[1], r[2]) for r in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--anchors', type=int, default=2000)
+    parser.add_argument('--penalties', type=int, default=6, help='penalties per anchor')
+    parser.add_argument('--history', type=int, default=24, help='months of penalty history')
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+    month = datetime.datetime(2099, 1, 1)
+
+    with app.app_context():
+        connection = db.engine.connect()
+        trans = connection.begin()
+        try:
+            seed(connection, month, args.anchors, args.penalties, args.history)
+
+            session = db.create_scoped_session({'bind': connection, 'binds': {}})
+            savepoint = connection.begin_nested()
+            start = time.perf_counter()
+            legacy_loop(session, month)
+            legacy_time = time.perf_counter() - start
+            expected = snapshot(connection, month)
+            session.close()
+            savepoint.rollback()
+
+            start = time.perf_counter()
+            updated = update_salaries(connection, month)
+            set_time = time.perf_counter() - start
+            actual = snapshot(connection, month)
+
+            mismatches = [m for m in expected if expected[m] != actual[m]]
+            print('rows:        {}'.format(updated))
+            print('legacy loop: {:.3f}s'.format(legacy_time))
+            print('aggregated:  {:.3f}s'.format(set_time))
+            print('speedup:     {:.1f}x'.format(legacy_time / set_time if set_time else float('inf')))
+            print('mismatches:  {}'.format(len(mismatches)))
+        finally:
+            trans.rollback()
+            connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# -*- coding: UTF-8 -*-
+"""
+Synthetic guild data: monthly workbooks shaped like the ones exported by the
+platform, and the anchors, penalties and comments that go with them.
+
+The sheets have the full platform header (月份, 陌陌号, 总陌币, 结算方式,
+公会分成金额(元), ...). Coins follow a heavy tailed distribution, the guild gets 4%
+of them, and a few rows are settled "对私" and skipped by the import. The
+generated anchors have momo numbers from --momo-base up, and the data is
+generated for months from --first-month on. Both default to values that real
+data does not use. The same --seed gives the same data.
+
+    python -m benchmarks.datagen --anchors 2000 --months 12 --output /tmp/guild
+    FLASK_CONFIG=development python -m benchmarks.datagen --anchors 2000 --months 12 --output /tmp/guild --load
+"""
+import argparse
+import datetime
+import os
+import random
+
+from openpyxl import Workbook
+
+HEADER = [u'月份', u'播主昵称', u'播主姓名', u'陌陌号', u'所属经纪人', u'经纪人陌陌号', u'连麦陌币', u'非连麦陌币',
+          u'总陌币', u'结算方式', u'播主分成金额(元)', u'公会分成金额(元)', u'播主奖励(元)', u'结算金额(元)',
+          u'实际收入(元)']
+MOMO_BASE = 990000000
+FIRST_MONTH = datetime.datetime(2001, 1, 1)
+GUILD_SHARE = 0.04
+SURNAMES = u'王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES = u'婷莹静丽敏燕娜雪琳晶颖洁慧欣怡佳悦彤'
+PENALTY_AMOUNTS = [50, 100, 200, 500]
+COMMENTS = [u'直播迟到', u'未按时开播', u'直播时长不足', u'表现优秀', u'违规用语']
+
+
+def momo_numbers(anchors, base=MOMO_BASE):
+    return [str(base + n) for n in range(anchors)]
+
+
+def months(count, first=FIRST_MONTH):
+    return [datetime.datetime(first.year + (first.month - 1 + n) // 12, (first.month - 1 + n) % 12 + 1, 1)
+            for n in range(count)]
+
+
+def anchor_name(rng):
+    return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+
+
+def sheet_rows(month, numbers, names, rng, active=0.9, private=0.05):
+    """
+    Yield the sheet rows of a month, for about `active` of the anchors
+    """
+    for momo in numbers:
+        if rng.random() > active:
+            continue
+        coins = round(rng.lognormvariate(10, 1.6), 1)
+        linked = round(coins * rng.random() * 0.1, 1) if rng.random() < 0.2 else 0
+        division = round(coins * GUILD_SHARE, 3)
+        reward = round(rng.random() * division * 0.05, 2)
+        settled = round(division + reward, 2)
+        yield [month.strftime('%Y-%m'), names[momo], names[momo], int(momo), None, None, linked,
+               coins - linked, coins, u'对私' if rng.random() < private else u'对公', 0, division, reward,
+               settled, settled]
+
+
+def write_workbook(path, month, numbers, names, rng):
+    """
+    Write the workbook of a month, returns the number of rows written
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(month.strftime('%Y%m'))
+    sheet.append(HEADER)
+    count = 0
+    for row in sheet_rows(month, numbers, names, rng):
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def write_workbooks(directory, numbers, names, month_list, rng):
+    """
+    Write one workbook per month into directory, returns their paths in month order
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for month in month_list:
+        path = os.path.join(directory, 'raw_{:%Y%m}.xlsx'.format(month))
+        write_workbook(path, month, numbers, names, rng)
+        paths.append(path)
+    return paths
+
+
+def seed_anchors(connection, numbers, names, rng):
+    from app.models import Anchor
+
+    connection.execute(Anchor.__table__.insert(), [
+        {'name': names[momo], 'momo_number': momo, 'entry_time': FIRST_MONTH,
+         'percentage': rng.choice([0.3, 0.4, 0.5, 0.6]), 'ace_anchor_or_not': rng.random() < 0.1,
+         'basic_salary_or_not': False, 'basic_salary': 0}
+        for momo in numbers])
+
+
+def seed_activity(connection, numbers, month_list, rng, penalties=0.3, comments=0.2):
+    """
+    Add on average `penalties` penalties and `comments` comments per anchor and month
+    """
+    from app.models import Comment, Penalty
+
+    penalty_rows, comment_rows = [], []
+    for month in month_list:
+        for momo in numbers:
+            day = month + datetime.timedelta(days=rng.randrange(28), hours=rng.randrange(24))
+            if rng.random() < penalties:
+                penalty_rows.append({'date': day, 'anchor_momo': momo, 'amount': rng.choice(PENALTY_AMOUNTS)})
+            if rng.random() < comments:
+                comment_rows.append({'date': day, 'anchor_momo': momo, 'comment': rng.choice(COMMENTS)})
+    if penalty_rows:
+        connection.execute(Penalty.__table__.insert(), penalty_rows)
+    if comment_rows:
+        connection.execute(Comment.__table__.insert(), comment_rows)
+    return len(penalty_rows), len(comment_rows)
+
+
+def clean(connection, numbers, month_list):
+    """
+    Delete the generated anchors and everything attached to them or imported for their months
+    """
+    from sqlalchemy import text, bindparam
+
+    for statement in ('delete from payrolls where anchor_momo in :numbers',
+                      'delete from penalties where anchor_momo in :numbers',
+                      'delete from comments where anchor_momo in :numbers',
+                      'delete from payroll_anchor_summaries where anchor_momo in :numbers',
+                      'delete from payroll_month_summaries where month in :months',
+                      'delete from import_jobs where id in (select job_id from import_manifests where month in :months)',
+                      'delete from import_manifests where month in :months',
+                      'delete from anchors where momo_number in :numbers'):
+        query = text(statement).bindparams(*(bindparam(name, expanding=True) for name in ('numbers', 'months')
+                                             if ':' + name in statement))
+        connection.execute(query, numbers=numbers, months=month_list)
+
+
+class Dataset(object):
+    """
+    Everything generated for one run, reproducible from its seed
+    """
+    def __init__(self, anchors, month_count, first_month=FIRST_MONTH, momo_base=MOMO_BASE, seed=1):
+        self.seed_value = seed
+        rng = random.Random(seed)
+        self.numbers = momo_numbers(anchors, momo_base)
+        self.names = {momo: anchor_name(rng) for momo in self.numbers}
+        self.months = months(month_count, first_month)
+
+    def write_workbooks(self, directory):
+        # sheets and database rows draw from their own streams, either can be generated alone
+        rng = random.Random('{}:sheets'.format(self.seed_value))
+        return write_workbooks(directory, self.numbers, self.names, self.months, rng)
+
+    def seed(self, connection, penalties=0.3, comments=0.2):
+        rng = random.Random('{}:database'.format(self.seed_value))
+        seed_anchors(connection, self.numbers, self.names, rng)
+        return seed_activity(connection, self.numbers, self.months, rng, penalties, comments)
+
+    def clean(self, connection):
+        clean(connection, self.numbers, self.months)
+
+
+def parse_month(value):
+    return datetime.datetime.strptime(value, '%Y-%m')
+
+
+def add_arguments(parser):
+    parser.add_argument('--anchors', type=int, default=2000)
+    parser.add_argument('--months', type=int, default=6)
+    parser.add_argument('--first-month', type=parse_month, default=FIRST_MONTH, help='YYYY-MM')
+    parser.add_argument('--momo-base', type=int, default=MOMO_BASE)
+    parser.add_argument('--penalties', type=float, default=0.3, help='penalties per anchor and month')
+    parser.add_argument('--comments', type=float, default=0.2, help='comments per anchor and month')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--output', required=True, help='directory of the workbooks')
+    parser.add_argument('--load', action='store_true', help='also add the anchors, penalties and comments '
+                                                            'to the database of FLASK_CONFIG')
+    args = parser.parse_args()
+
+    dataset = Dataset(args.anchors, args.months, args.first_month, args.momo_base, args.seed)
+    for path in dataset.write_workbooks(args.output):
+        print(path)
+
+    if args.load:
+        from app import create_app, db
+        from app.admin.anchor_index import invalidate_anchor_index
+
+        app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+        with app.app_context():
+            with db.engine.begin() as connection:
+                penalties, comments = dataset.seed(connection, args.penalties, args.comments)
+            invalidate_anchor_index()
+        print('{} anchors, {} penalties, {} comments added.'.format(len(dataset.numbers), penalties, comments))
+
+
+if __name__ == '__main__':
+    main()
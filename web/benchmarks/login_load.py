@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+"""
+Login latency of a legitimate employee while the login form is flooded with bad passwords.
+
+The application is served by a threaded werkzeug server inside this process (one
+worker process, like a single uWSGI worker with threads). Attacker threads post
+wrong passwords for --victims existing accounts from a pool of client addresses,
+so every attempt that gets through costs a full password hash, while one employee
+logs in every --interval seconds. The run is repeated with the login guard effectively disabled
+(huge rate limits and hash queue) to show the difference:
+
+    FLASK_CONFIG=development python -m benchmarks.login_load --attackers 32 --duration 20
+
+The employees used by the run are created for it and deleted at the end.
+"""
+import argparse
+import http.client
+import os
+import random
+import tempfile
+import threading
+import logging
+import time
+import urllib.parse
+
+from werkzeug.serving import make_server
+
+from app import create_app, db, login_guard
+from app.models import Employee
+
+EMAIL = 'login-load@example.com'
+PASSWORD = 'login-load-2019'
+
+
+def post_login(port, email, password, client_ip):
+    body = urllib.parse.urlencode({'email': email, 'password': password})
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    start = time.perf_counter()
+    try:
+        connection.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded',
+                                                    'X-Real-IP': client_ip})
+        status = connection.getresponse().status
+    except (OSError, http.client.HTTPException):
+        status = None
+    finally:
+        connection.close()
+    return status, (time.perf_counter() - start) * 1000
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def victim_email(n):
+    return 'login-load-victim{}@example.com'.format(n)
+
+
+def run(app, attackers, victims, duration, interval):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stop = threading.Event()
+    attack = {'sent': 0, 'throttled': 0}
+
+    def attacker(n):
+        while not stop.is_set():
+            # a few addresses guessing the passwords of many accounts
+            status, _ = post_login(port, victim_email(random.randrange(victims)), 'wrong',
+                                   '10.0.0.{}'.format(n % 4))
+            attack['sent'] += 1
+            attack['throttled'] += status == 429
+
+    threads = [threading.Thread(target=attacker, args=(n,), daemon=True) for n in range(attackers)]
+    for t in threads:
+        t.start()
+
+    legit, failures = [], 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        status, ms = post_login(port, EMAIL, PASSWORD, '192.168.1.10')
+        if status == 302:
+            legit.append(ms)
+        else:
+            failures += 1
+        time.sleep(interval)
+
+    stop.set()
+    for t in threads:
+        t.join()
+    server.shutdown()
+    return legit, failures, attack
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--attackers', type=int, default=32)
+    parser.add_argument('--victims', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+    app.config.update(WTF_CSRF_ENABLED=False, LOGIN_CLIENT_IP_HEADER='X-Real-IP', PROFILE_REQUESTS=False)
+
+    with app.app_context():
+        employee = Employee(email=EMAIL, username='login-load', password=PASSWORD)
+        db.session.add(employee)
+        db.session.add_all(Employee(email=victim_email(n), username='login-load-victim{}'.format(n),
+                                    password_hash=employee.password_hash)
+                           for n in range(args.victims))
+        db.session.commit()
+
+    try:
+        settings = [
+            ('unguarded', dict(LOGIN_IP_RATE=(10 ** 9, 1), LOGIN_EMAIL_RATE=(10 ** 9, 1), LOGIN_HASH_QUEUE=10 ** 6)),
+            ('guarded', dict(LOGIN_IP_RATE=(10, 60), LOGIN_EMAIL_RATE=(5, 300), LOGIN_HASH_QUEUE=4)),
+        ]
+        for name, config in settings:
+            config['LOGIN_THROTTLE_DB'] = os.path.join(tempfile.mkdtemp(), 'throttle.sqlite')
+            app.config.update(config)
+            login_guard.init_app(app)
+
+            legit, failures, attack = run(app, args.attackers, args.victims, args.duration, args.interval)
+            print('{:<10} legit logins: {:4d} ok, {:3d} failed, p50 {:8.1f} ms, p99 {:8.1f} ms | '
+                  'attack requests: {:6d}, throttled {:6d}'.format(
+                      name, len(legit), failures, percentile(legit, 50), percentile(legit, 99),
+                      attack['sent'], attack['throttled']))
+            print('           guard: {}'.format(login_guard.stats()))
+    finally:
+        with app.app_context():
+            Employee.query.filter(Employee.email.like('login-load%@example.com')).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+"""
+Query plan regression check for the hot payroll, penalty and comment lookups.
+
+A large synthetic dataset is generated inside a transaction, the tables are
+analyzed, and every hot query is EXPLAINed. The check fails (exit status 1) if
+any of them reads one of the big tables with a sequential scan instead of an
+index. Nothing is committed, so it can run against any migrated database:
+
+    FLASK_CONFIG=development python -m benchmarks.query_plans --anchors 5000 --months 36
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+from sqlalchemy import text
+
+from app import create_app, db
+
+SEED = [
+    """insert into anchors (name, momo_number, percentage, ace_anchor_or_not)
+       select 'qp' || n, 'qp' || n, 0.5, n % 5 = 0 from generate_series(1, :anchors) n""",
+    """insert into payrolls (date, anchor_momo, coins, salary, penalty)
+       select :first + make_interval(months => m), 'qp' || n, n * 10, n, 0
+       from generate_series(1, :anchors) n, generate_series(0, :months - 1) m""",
+    """insert into penalties (date, anchor_momo, amount)
+       select :first + make_interval(months => m, days => d), 'qp' || n, 10
+       from generate_series(1, :anchors) n, generate_series(0, :months - 1) m, generate_series(1, 3) d""",
+    """insert into comments (date, anchor_momo, comment)
+       select :first + make_interval(months => m, days => 2), 'qp' || n, 'comment'
+       from generate_series(1, :anchors) n, generate_series(0, :months - 1) m""",
+]
+
+# name, table that must not be sequentially scanned, query
+HOT_QUERIES = [
+    ('payroll of an anchor in a month', 'payrolls',
+     "select * from payrolls where anchor_momo = :momo and date = :month"),
+    ('payroll history of an anchor', 'payrolls',
+     "select * from payrolls where anchor_momo = :momo order by date desc"),
+    ('payroll listing of a month', 'payrolls',
+     "select * from payrolls where date = :month order by anchor_momo, id limit 51"),
+    ('penalties of an anchor in a month', 'penalties',
+     "select * from penalties where anchor_momo = :momo and date >= :month and date < :next_month"),
+    ('penalty totals of a month', 'penalties',
+     """select anchor_momo, sum(amount) from penalties
+        where date >= :month and date < :next_month group by anchor_momo"""),
+    ('comments of an anchor in a month', 'comments',
+     "select * from comments where anchor_momo = :momo and date >= :month and date < :next_month"),
+    ('comment listing by date', 'comments',
+     "select * from comments order by date desc, id desc limit 51"),
+]
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        for p in walk(child):
+            yield p
+
+
+def check(connection, name, table, query, params):
+    row = connection.execute(text('explain (format json) ' + query), **params).first()
+    plan = row[0] if isinstance(row[0], list) else json.loads(row[0])
+    nodes = list(walk(plan[0]['Plan']))
+
+    seq_scans = [n for n in nodes if n['Node Type'] == 'Seq Scan' and n.get('Relation Name') == table]
+    index_scans = [n for n in nodes if 'Index' in n['Node Type']]
+    ok = not seq_scans and bool(index_scans)
+    used = ', '.join(sorted(set(n.get('Index Name', n['Node Type']) for n in index_scans))) or 'no index'
+    print('{:<4} {:<36} {}'.format('ok' if ok else 'FAIL', name, used))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--anchors', type=int, default=5000)
+    parser.add_argument('--months', type=int, default=36)
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+    first = datetime.datetime(2090, 1, 1)
+    month = datetime.datetime(2090 + (args.months // 2) // 12, (args.months // 2) % 12 + 1, 1)
+    next_month = datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+    params = dict(momo='qp{}'.format(args.anchors // 2), month=month, next_month=next_month)
+
+    with app.app_context():
+        connection = db.engine.connect()
+        trans = connection.begin()
+        try:
+            for statement in SEED:
+                connection.execute(text(statement), anchors=args.anchors, months=args.months, first=first)
+            connection.execute('analyze anchors, payrolls, penalties, comments')
+
+            results = [check(connection, name, table, query, params) for name, table, query in HOT_QUERIES]
+        finally:
+            trans.rollback()
+            connection.close()
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
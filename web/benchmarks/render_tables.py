@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+"""
+Render time of the anchor and payroll tables against their number of rows.
+
+Each table is rendered from in-memory rows, so only the template work is
+measured, in three ways:
+
+    plain   fragment cache disabled, every row rendered
+    cold    fragment cache enabled right after its data set changed
+    warm    fragment cache enabled, rows already rendered once
+
+and the time to load the two templates in a fresh process is measured with
+no bytecode cache, with an empty one, and with the one left by the previous run:
+
+    FLASK_CONFIG=development python -m benchmarks.render_tables --rows 50 500 5000
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+from flask import render_template
+
+from app import create_app
+from app.cache import bump_version
+from app.admin.pagination import KeysetPage
+from app.templating import SharedBytecodeCache
+
+TEMPLATES = ['admin/anchors/anchors.html', 'admin/search/results/payrolls.html']
+MONTH = datetime.datetime(2019, 8, 1)
+
+
+def make_anchors(rows):
+    return [SimpleNamespace(id=n, name=u'主播{}'.format(n), momo_number=str(100000000 + n),
+                            mobile_number='1380000{:04d}'.format(n % 10000), basic_salary_or_not=n % 7 == 0,
+                            basic_salary=3000, percentage=0.5, ace_anchor_or_not=n % 10 == 0)
+            for n in range(rows)]
+
+
+def make_payrolls(anchors):
+    return [SimpleNamespace(id=a.id, host=a, coins=1000.0 * a.id, anchor_reward=12.5, penalty=100,
+                            salary=20.0 * a.id) for a in anchors]
+
+
+def render(app, table, items):
+    page = KeysetPage(items, None, 'momo_number', 'asc', True)
+    # a context of its own, like every request has
+    with app.app_context(), app.test_request_context('/'):
+        if table == 'anchors':
+            return render_template(TEMPLATES[0], anchors=items, page=page, q='', title='Anchors')
+        return render_template(TEMPLATES[1], payrolls=items, page=page, q='', date=str(MONTH),
+                               year=MONTH.year, month=MONTH.month, salary_total=0, title='Payrolls')
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        ms = (time.perf_counter() - start) * 1000
+        best = ms if best is None else min(best, ms)
+    return best
+
+
+def render_times(app, rows, repeat):
+    anchors = make_anchors(rows)
+    tables = {'anchors': anchors, 'payrolls': make_payrolls(anchors)}
+    for table, items in tables.items():
+        app.config['FRAGMENT_CACHE_ENABLED'] = False
+        plain = timed(lambda: render(app, table, items), repeat)
+
+        app.config['FRAGMENT_CACHE_ENABLED'] = True
+
+        def cold():
+            bump_version(table)
+            render(app, table, items)
+        cold_ms = timed(cold, repeat)
+        warm = timed(lambda: render(app, table, items), repeat)
+
+        print('{:<9} {:6d} rows   plain {:8.1f} ms   cold {:8.1f} ms   warm {:8.1f} ms   ({:.1f}x)'.format(
+            table, rows, plain, cold_ms, warm, plain / warm if warm else float('nan')))
+
+
+def load_time(bytecode_dir):
+    # a new application has a new jinja environment, as a freshly started worker does
+    env = create_app(os.getenv('FLASK_CONFIG', 'default')).jinja_env
+    env.bytecode_cache = SharedBytecodeCache(bytecode_dir) if bytecode_dir else None
+    start = time.perf_counter()
+    for name in TEMPLATES + ['base.html', '_pagination.html']:
+        env.get_template(name)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--repeat', type=int, default=5, help='renders per measure, the best one is kept')
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='bench-jinja-')
+    versions_dir = tempfile.mkdtemp(prefix='bench-versions-')
+    try:
+        app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+        # private version tokens, the bumps of the run do not reach a running application
+        app.config.update(CACHE_VERSION_DIR=versions_dir, SQLALCHEMY_ECHO=False, PROFILE_REQUESTS=False)
+        with app.app_context():
+            for rows in args.rows:
+                render_times(app, rows, args.repeat)
+
+        print('template load   no bytecode cache {:7.1f} ms   empty cache {:7.1f} ms   filled cache {:7.1f} ms'.format(
+            load_time(None), load_time(cache_dir), load_time(cache_dir)))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        shutil.rmtree(versions_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
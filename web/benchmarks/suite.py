@@ -0,0 +1,235 @@
+# -*- coding: UTF-8 -*-
+"""
+Timed scenarios of the payroll pages and jobs on synthetic data, with the results as JSON.
+
+A dataset from benchmarks.datagen is loaded into the database of FLASK_CONFIG
+(anchors, penalties and comments), then each scenario is timed:
+
+    import   upload of every monthly workbook through /admin/upload and its import job
+    salary   update_salaries and refresh_summaries of a month
+    search   /admin/search_payroll and /admin/anchor_results of random anchors
+    listing  /admin/payrolls of a month, first page, sorted and filtered
+    chart    /admin/search_by_anchor with a cold and a warm chart cache
+
+The requests go through the application in this process, so the timings cover
+the views, queries and templates but not a web server. Everything the run adds
+is deleted at the end unless --keep is given. Use a scratch database: months
+already imported there make the import scenario fail.
+
+    FLASK_CONFIG=development python -m benchmarks.suite --anchors 2000 --months 6 --output results.json
+
+Runs with the same parameters and seed work on the same data, compare their
+JSON files to see the effect of a change.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from app import create_app, db
+from app.admin.anchor_index import invalidate_anchor_index
+from app.admin.jobs import claim_job, run_import
+from app.admin.repository import invalidate_payrolls
+from app.admin.salary import update_salaries
+from app.admin.summary import refresh_summaries
+from app.cache import bump_version
+from app.models import Employee, ImportJob, ImportManifest, Log
+
+from .datagen import Dataset, add_arguments
+
+USER = 'bench-suite'
+EMAIL = 'bench-suite@example.com'
+PASSWORD = 'bench-suite-2019'
+SCENARIOS = ['import', 'salary', 'search', 'listing', 'chart']
+
+
+def summarize(samples, errors=0, **extra):
+    result = {'samples': len(samples), 'errors': errors}
+    if samples:
+        ordered = sorted(samples)
+
+        def at(p):
+            return round(ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))], 2)
+
+        result.update(min_ms=round(ordered[0], 2), p50_ms=at(50), p95_ms=at(95), max_ms=round(ordered[-1], 2),
+                      mean_ms=round(sum(ordered) / len(ordered), 2))
+    result.update(extra)
+    return result
+
+
+class Timer(object):
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+
+    def get(self, client, url, expected=200):
+        start = time.perf_counter()
+        response = client.get(url)
+        self.samples.append((time.perf_counter() - start) * 1000)
+        if expected is not None and response.status_code != expected:
+            self.errors += 1
+        return response
+
+
+def scenario_import(app, client, dataset, paths, args):
+    samples, errors, rows = [], 0, 0
+    for path in paths:
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            client.post('/admin/upload', data={'upload_file': (io.BytesIO(f.read()), os.path.basename(path))},
+                        content_type='multipart/form-data')
+        job_id = claim_job()
+        if job_id is not None:
+            run_import(job_id)
+        samples.append((time.perf_counter() - start) * 1000)
+        db.session.remove()
+
+        job = ImportJob.query.get(job_id) if job_id is not None else None
+        if job is None or job.status != 'success':
+            errors += 1
+            print('  import of {} failed: {}'.format(os.path.basename(path), job.message if job else 'not queued'))
+        else:
+            rows += ImportManifest.query.filter_by(job_id=job_id).first().row_count
+    total_s = sum(samples) / 1000
+    return summarize(samples, errors, rows=rows, rows_per_s=round(rows / total_s, 1) if total_s else None)
+
+
+def scenario_salary(app, client, dataset, paths, args):
+    samples = []
+    for _ in range(args.repeat):
+        month = random.choice(dataset.months)
+        start = time.perf_counter()
+        with db.engine.begin() as connection:
+            update_salaries(connection, month)
+            refresh_summaries(connection, month)
+        samples.append((time.perf_counter() - start) * 1000)
+    invalidate_payrolls()
+    return summarize(samples)
+
+
+def scenario_search(app, client, dataset, paths, args):
+    payroll, anchor = Timer(), Timer()
+    for _ in range(args.repeat):
+        momo = random.choice(dataset.numbers)
+        # an anchor missing from the month redirects back to the search form
+        payroll.get(client, '/admin/search_payroll/{}/{:%Y%m}'.format(momo, random.choice(dataset.months)),
+                    expected=None)
+        anchor.get(client, '/admin/anchor_results/{}'.format(momo))
+    return {'search_payroll': summarize(payroll.samples), 'anchor_results': summarize(anchor.samples, anchor.errors)}
+
+
+def scenario_listing(app, client, dataset, paths, args):
+    timers = {'first_page': Timer(), 'by_salary': Timer(), 'filtered': Timer()}
+    for _ in range(args.repeat):
+        url = '/admin/payrolls/{}'.format(random.choice(dataset.months))
+        timers['first_page'].get(client, url)
+        timers['by_salary'].get(client, url + '?sort=salary&order=desc')
+        timers['filtered'].get(client, url + '?q=' + dataset.numbers[0][:6])
+    return {name: summarize(t.samples, t.errors) for name, t in timers.items()}
+
+
+def scenario_chart(app, client, dataset, paths, args):
+    cold, warm = Timer(), Timer()
+    for _ in range(args.repeat):
+        url = '/admin/search_by_anchor/{}'.format(random.choice(dataset.numbers))
+        # drops the charts of every anchor, a repeated anchor is built again too
+        bump_version('salary_charts')
+        cold.get(client, url)
+        warm.get(client, url)
+    return {'cold': summarize(cold.samples, cold.errors), 'warm': summarize(warm.samples, warm.errors)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=20, help='samples per request scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, in this order')
+    parser.add_argument('--output', default='-', help='JSON results file, - for stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data in the database')
+    args = parser.parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    # uploads are stored under UPLOAD_FOLDER/table_store
+    os.environ['UPLOAD_FOLDER'] = workdir
+    os.makedirs(os.path.join(workdir, 'table_store'))
+    app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+    app.config.update(WTF_CSRF_ENABLED=False, SQLALCHEMY_ECHO=False, PROFILE_REQUESTS=False,
+                      LOGIN_THROTTLE_DB=os.path.join(workdir, 'throttle.sqlite'))
+
+    dataset = Dataset(args.anchors, args.months, args.first_month, args.momo_base, args.seed)
+    paths = dataset.write_workbooks(os.path.join(workdir, 'workbooks'))
+
+    results = {
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'parameters': {k: (v.strftime('%Y-%m') if isinstance(v, datetime.datetime) else v)
+                       for k, v in vars(args).items() if k not in ('output', 'keep')},
+        'scenarios': {},
+    }
+
+    with app.app_context():
+        results['database'] = db.engine.execute(text('show server_version')).scalar()
+        with db.engine.begin() as connection:
+            penalties, comments = dataset.seed(connection, args.penalties, args.comments)
+        # left over by a run with --keep
+        Employee.query.filter_by(email=EMAIL).delete()
+        db.session.add(Employee(email=EMAIL, username=USER, password=PASSWORD, is_admin=True))
+        db.session.commit()
+        invalidate_anchor_index()
+        invalidate_payrolls()
+        results['dataset'] = {'anchors': len(dataset.numbers), 'months': len(dataset.months),
+                              'penalties': penalties, 'comments': comments}
+
+        try:
+            with app.test_client() as client:
+                client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+                for name in scenarios:
+                    start = time.perf_counter()
+                    results['scenarios'][name] = globals()['scenario_' + name](app, client, dataset, paths, args)
+                    print('{:<8} done in {:.1f} s'.format(name, time.perf_counter() - start), file=sys.stderr)
+        finally:
+            db.session.remove()
+            if not args.keep:
+                with db.engine.begin() as connection:
+                    dataset.clean(connection)
+                    connection.execute(Log.__table__.delete().where(Log.user == USER))
+                    connection.execute(Employee.__table__.delete().where(Employee.email == EMAIL))
+                invalidate_anchor_index()
+                invalidate_payrolls()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print('results written to {}'.format(args.output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
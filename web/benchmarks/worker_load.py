@@ -0,0 +1,252 @@
+# -*- coding: UTF-8 -*-
+"""
+Throughput of the gunicorn worker models under mixed traffic.
+
+Client threads log in as an admin and then loop over a mix of requests: the
+anchor listing (a database query and a template), the login page, and password
+reset requests. A reset sends a mail through a stand-in SMTP server on localhost
+that answers after --smtp-delay seconds per round trip, the way the remote server
+does over SSL. Each worker model is started with gunicorn.conf.py in turn:
+
+    sync          sync workers, the mail sent in the request (the former setup)
+    gthread       threaded workers, the mail sent in the request
+    gthread+pool  threaded workers, the mail handed to the background task pool
+    gevent+pool   gevent workers, when the gevent package is installed
+
+    FLASK_CONFIG=development python -m benchmarks.worker_load --clients 16 --duration 20 \\
+        --database-uri postgresql://postgres@localhost/stage_db
+
+The employees used by the run are created for it and deleted at the end.
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from app import create_app, db
+from app.models import Employee
+
+EMAIL = 'worker-load@example.com'
+PASSWORD = 'worker-load-2019'
+MIX = [('anchors', 6), ('login_page', 3), ('reset', 1)]
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if os.getenv('WORKER_LOAD_CONFIG'):
+    # imported by a gunicorn worker of this benchmark, serve the app with the settings of the run
+    application = create_app(os.getenv('FLASK_CONFIG', 'default'))
+    application.config.update(json.loads(os.environ['WORKER_LOAD_CONFIG']))
+    # Flask-Mail reads its settings once in init_app: send even under the testing config, quietly
+    application.extensions['mail'].suppress = application.config['MAIL_SUPPRESS_SEND']
+    application.extensions['mail'].debug = 0
+
+
+class SlowSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough SMTP for smtplib, every reply is delayed by the server's delay
+    """
+    def reply(self, line):
+        time.sleep(self.server.delay)
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost stand-in SMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith('DATA'):
+                self.wfile.write(b'354 end data with <CR><LF>.<CR><LF>\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.received += 1
+                self.reply('250 queued')
+            elif command.startswith('EHLO'):
+                # the application logs in with its MAIL_USERNAME, accept any credentials
+                self.wfile.write(b'250-localhost\r\n')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif command.startswith('AUTH'):
+                self.reply('235 authenticated')
+            elif command.startswith('QUIT'):
+                self.wfile.write(b'221 bye\r\n')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class SlowSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), SlowSMTPHandler)
+        self.delay = delay
+        self.received = 0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(port, worker_class, workers, threads, app_config, smtp_port):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads), GUNICORN_BIND='127.0.0.1:{}'.format(port),
+               MAIL_SERVER='127.0.0.1', MAIL_PORT=str(smtp_port), MAIL_USE_SSL='false',
+               WORKER_LOAD_CONFIG=json.dumps(app_config))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                '--log-level', 'warning', 'benchmarks.worker_load:application'],
+                               cwd=WEB_DIR, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen('http://127.0.0.1:{}/login'.format(port), timeout=5).read()
+            return process
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+class Client(object):
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def get(self, path):
+        with self.opener.open(self.base + path, timeout=60) as response:
+            return response.status, response.read().decode('utf-8')
+
+    def post_form(self, path, data):
+        # the forms are protected by CSRF, take the token of a fresh page first
+        _, page = self.get(path)
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        if token:
+            data = dict(data, csrf_token=token.group(1))
+        body = urllib.parse.urlencode(data).encode()
+        with self.opener.open(self.base + path, body, timeout=60) as response:
+            return response.status, response.read()
+
+    def request(self, kind):
+        if kind == 'anchors':
+            return self.get('/admin/anchors')[0]
+        if kind == 'login_page':
+            return self.get('/login')[0]
+        return self.post_form('/reset_password', {'email': EMAIL})[0]
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def run(port, clients, duration):
+    base = 'http://127.0.0.1:{}'.format(port)
+    kinds = [kind for kind, weight in MIX for _ in range(weight)]
+    timings = {kind: [] for kind, _ in MIX}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        c = Client(base)
+        c.post_form('/login', {'email': EMAIL, 'password': PASSWORD})
+        while time.time() < deadline:
+            kind = random.choice(kinds)
+            start = time.perf_counter()
+            try:
+                ok = c.request(kind) == 200
+            except (OSError, urllib.error.URLError):
+                ok = False
+            ms = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    timings[kind].append(ms)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return timings, errors[0], time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=2, help='worker processes of every model')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--smtp-delay', type=float, default=0.2, help='seconds per SMTP round trip')
+    parser.add_argument('--database-uri', help='database of the run, the one of FLASK_CONFIG otherwise')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app(os.getenv('FLASK_CONFIG', 'default'))
+    app_config = {'PROFILE_REQUESTS': False, 'MAIL_SUPPRESS_SEND': False, 'LOGIN_IP_RATE': [10 ** 6, 1],
+                  'LOGIN_THROTTLE_DB': os.path.join(tempfile.mkdtemp(), 'throttle.sqlite')}
+    if args.database_uri:
+        app_config['SQLALCHEMY_DATABASE_URI'] = args.database_uri
+    app.config.update(app_config)
+
+    with app.app_context():
+        db.session.add(Employee(email=EMAIL, username='worker-load', password=PASSWORD, is_admin=True))
+        db.session.commit()
+
+    smtp = SlowSMTPServer(args.smtp_delay)
+    threading.Thread(target=smtp.serve_forever, daemon=True).start()
+
+    models = [('sync', 'sync', True), ('gthread', 'gthread', True), ('gthread+pool', 'gthread', False)]
+    try:
+        import gevent  # noqa: F401
+        models.append(('gevent+pool', 'gevent', False))
+    except ImportError:
+        pass
+
+    try:
+        for name, worker_class, offload_sync in models:
+            port = free_port()
+            process = start_gunicorn(port, worker_class, args.workers, args.threads,
+                                     dict(app_config, OFFLOAD_SYNC=offload_sync), smtp.server_address[1])
+            try:
+                received = smtp.received
+                timings, errors, elapsed = run(port, args.clients, args.duration)
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait()
+
+            total = sum(len(t) for t in timings.values())
+            # the pooled mails of a run are sent by the time its workers have stopped
+            print('{:<13} {:7.1f} req/s, {:3d} errors, {:4d} mails | {}'.format(
+                name, total / elapsed, errors, smtp.received - received,
+                ' | '.join('{} p50 {:6.1f} p99 {:7.1f} ms'.format(kind, percentile(t, 50), percentile(t, 99))
+                           for kind, t in timings.items())))
+    finally:
+        smtp.shutdown()
+        with app.app_context():
+            Employee.query.filter_by(email=EMAIL).delete()
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Archive what earlier imports left on the database and the upload volume.
+
+- raw_data_* tables (kept by imports before staging became temporary, and by
+  db_data/prepare_db.py) are copied to UPLOAD_FOLDER/archive/tables/<table>.csv.gz
+  and dropped.
+- uploaded workbooks older than --days, except those whose import failed and may
+  still be replayed, are gzipped to UPLOAD_FOLDER/archive/table_store/.
+
+    FLASK_CONFIG=production python compact_uploads.py --days 90 [--dry-run]
+"""
+import argparse
+import datetime
+import gzip
+import os
+import shutil
+
+from sqlalchemy import text
+
+from app import create_app, db
+from app.models import ImportManifest
+
+config_name = os.getenv('FLASK_CONFIG')
+
+LEGACY_TABLES = "select tablename from pg_tables where schemaname = 'public' and tablename like 'raw\\_data\\_%' order by tablename"
+
+
+def archive_tables(archive, dry_run):
+    directory = os.path.join(archive, 'tables')
+    os.makedirs(directory, exist_ok=True)
+
+    tables = [r[0] for r in db.engine.execute(text(LEGACY_TABLES))]
+    for table in tables:
+        path = os.path.join(directory, table + '.csv.gz')
+        print('{} -> {}'.format(table, path))
+        if dry_run:
+            continue
+
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            with gzip.open(path + '.tmp', 'wb') as f:
+                cursor.copy_expert('copy "{}" to stdout with (format csv, header)'.format(table), f)
+            os.replace(path + '.tmp', path)
+            # dropped only once the archive is safely on disk
+            cursor.execute('drop table "{}"'.format(table))
+            connection.commit()
+        finally:
+            connection.close()
+    return len(tables)
+
+
+def archive_uploads(store, archive, days, dry_run):
+    directory = os.path.join(archive, 'table_store')
+    os.makedirs(directory, exist_ok=True)
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).timestamp()
+
+    manifests = {m.path: m for m in ImportManifest.query}
+    archived = 0
+    for name in sorted(os.listdir(store)):
+        source = os.path.join(store, name)
+        manifest = manifests.get(source)
+        if name.startswith('.') or not os.path.isfile(source) or os.path.getmtime(source) >= cutoff:
+            continue
+        if manifest is not None and manifest.status in ('failed', 'queued'):
+            continue
+
+        target = os.path.join(directory, name + '.gz')
+        print('{} -> {}'.format(source, target))
+        archived += 1
+        if dry_run:
+            continue
+
+        with open(source, 'rb') as f, gzip.open(target + '.tmp', 'wb') as out:
+            shutil.copyfileobj(f, out)
+        os.replace(target + '.tmp', target)
+        if manifest is not None:
+            manifest.path = target
+            db.session.commit()
+        os.remove(source)
+    return archived
+
+
+def compact_uploads():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=90, help='keep uploaded workbooks younger than this')
+    parser.add_argument('--dry-run', action='store_true', help='only list what would be archived')
+    args = parser.parse_args()
+
+    app = create_app(config_name)
+    upload_folder = os.getenv('UPLOAD_FOLDER')
+    archive = os.path.join(upload_folder, 'archive')
+
+    with app.app_context():
+        tables = archive_tables(archive, args.dry_run)
+        uploads = archive_uploads(os.path.join(upload_folder, 'table_store'), archive, args.days, args.dry_run)
+    print('{} raw_data tables and {} uploaded files {}archived.'.format(
+        tables, uploads, 'would be ' if args.dry_run else ''))
+
+if __name__ == "__main__":
+    compact_uploads()
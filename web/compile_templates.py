@@ -0,0 +1,18 @@
+from app import create_app
+import os
+
+config_name = os.getenv('FLASK_CONFIG')
+
+def compile_templates():
+    """
+    Fill the shared bytecode cache, so the workers load compiled templates from their first request
+    """
+    app = create_app(config_name)
+
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    print('{} templates compiled into {}.'.format(len(names), app.config['JINJA_BYTECODE_DIR']))
+
+if __name__ == "__main__":
+    compile_templates()
@@ -18,5 +18,8 @@ flask db migrate
 flask db upgrade
 
 python create_admin.py 
-/usr/local/bin/gunicorn -w 2 --bind 0.0.0.0:8000 wsgi
+python refresh_summaries.py
+python compile_templates.py
+python import_worker.py &
+/usr/local/bin/gunicorn -c gunicorn.conf.py wsgi
  
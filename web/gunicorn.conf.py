@@ -0,0 +1,39 @@
+"""
+gunicorn settings, every value can be overridden from the environment:
+
+    GUNICORN_WORKER_CLASS   gthread (default), sync or gevent
+    GUNICORN_WORKERS        worker processes, defaults to the number of CPUs + 1
+    GUNICORN_THREADS        threads per gthread worker, defaults to 4
+    GUNICORN_CONNECTIONS    concurrent requests per gevent worker, defaults to 100
+    GUNICORN_TIMEOUT        seconds before a silent worker is restarted
+    GUNICORN_BIND           address to listen on
+
+Each worker process has its own connection pool of DB_POOL_SIZE + DB_MAX_OVERFLOW
+connections, the production config sizes it from GUNICORN_WORKERS and
+DB_MAX_CONNECTIONS so that all the workers stay below the server's limit. A
+gthread worker should have no more threads than DB_POOL_SIZE. The database
+calls of gevent workers wait cooperatively, but password hashing and sheet
+parsing still block the whole worker.
+
+    gunicorn -c gunicorn.conf.py wsgi
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+# gunicorn turns sync workers with several threads into gthread ones, keep sync meaning sync
+threads = int(os.getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_CONNECTIONS', 100))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# nginx keeps the client connections, the ones from the proxy are cheap
+keepalive = 5
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # let psycopg2 wait on the (monkey patched) select instead of blocking the hub
+        import psycopg2.extensions
+        import psycopg2.extras
+        psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
@@ -0,0 +1,85 @@
+import logging
+import multiprocessing
+import os
+import signal
+
+from app import create_app, db
+from app.admin.jobs import claim_job, run_import, requeue_interrupted, finish_job
+from app.admin.recalc import recalculate_dirty
+
+config_name = os.getenv('FLASK_CONFIG', 'default')
+logger = logging.getLogger('import_worker')
+
+
+def work(stop):
+    """
+    Poll the import_jobs queue and run jobs until asked to stop, computing
+    stale salaries while the queue is empty
+    """
+    app = create_app(config_name)
+
+    with app.app_context():
+        interval = app.config['IMPORT_POLL_INTERVAL']
+        while not stop.is_set():
+            job_id = claim_job()
+            if job_id is None:
+                # one batch between polls, an upload does not wait for a long backlog
+                if not recalculate_salaries():
+                    stop.wait(interval)
+                continue
+
+            try:
+                run_import(job_id)
+            except Exception as e:
+                logger.exception('import job %s failed', job_id)
+                finish_job(job_id, 'failed', str(e))
+            finally:
+                db.session.remove()
+
+
+def recalculate_salaries():
+    """
+    Compute a batch of stale salaries, return the number of payrolls done
+    """
+    try:
+        done = recalculate_dirty(max_batches=1)
+    except Exception:
+        logger.exception('salary recalculation failed')
+        done = 0
+    finally:
+        db.session.remove()
+    if done:
+        logger.info('recalculated the salaries of %d anchor months', done)
+    return done
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    app = create_app(config_name)
+    with app.app_context():
+        requeue_interrupted()
+        workers = app.config['IMPORT_WORKERS']
+        # children open their own connections
+        db.engine.dispose()
+
+    stop = multiprocessing.Event()
+
+    def shutdown(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    processes = [multiprocessing.Process(target=work, args=(stop,), name='import-worker-{}'.format(i))
+                 for i in range(workers)]
+    for p in processes:
+        p.start()
+    logger.info('started %d import workers', workers)
+
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+from app import create_app, db
+from app.admin.summary import refresh_all_summaries
+from app.admin.repository import invalidate_payrolls
+from app.database import disable_statement_timeout
+import os
+
+config_name = os.getenv('FLASK_CONFIG')
+
+def refresh_summaries():
+    app = create_app(config_name)
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            disable_statement_timeout(connection)
+            months = refresh_all_summaries(connection)
+        invalidate_payrolls()
+        print('{} monthly payroll summaries refreshed.'.format(len(months)))
+
+if __name__ == "__main__":
+    refresh_summaries()